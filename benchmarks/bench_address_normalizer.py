@@ -0,0 +1,98 @@
+# coding=utf-8
+""" Throughput of address normalization and parsing on a corpus of Taipei
+addresses (one per line), compared with the previous implementation.
+
+    $ python benchmarks/bench_address_normalizer.py [addresses.txt]
+"""
+
+import os
+import re
+import sys
+import time
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import address_normalizer
+from livelihood_database import location_parser
+from livelihood_database import power_web_parser
+
+_FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'taipei_addresses.txt')
+_REPEAT = 20
+
+
+def substitute(sub_before, sub_after, address_str, delete_flag):
+    """ The previous character-list substitution. """
+    str = list(address_str)
+    i = 0
+    while(i != len(str)):
+        if str[i] == sub_before:
+            if not delete_flag:
+                if not i == 0:
+                    if str[i-1].isnumeric():
+                        str[i] = sub_after
+                    else:
+                        str[i] = ''
+            else:
+                if not i == 0 and not str[i-1].isnumeric():
+                    str[i] = sub_after
+        i += 1
+    return ''.join(str)
+
+
+def substitute_address_conjunction(str):
+    """ The previous five-pass conjunction substitution. """
+    str = substitute('－', '-', str, False)
+    str = substitute('之', '-', str, False)
+    str = substitute('至', '號', str, False)
+    str = substitute('及', '號', str, False)
+    str = re.sub('．|‧|、|／|/|～|~', '號', str)
+    str = substitute('號', '', str, True)
+    return str
+
+
+def previous_candidates(raw):
+    candidates = []
+    for str in re.split('，', re.sub('\s|（|）', '', raw)):
+        address = re.search(address_normalizer.ADDRESS_REGEX, substitute_address_conjunction(str))
+        if address:
+            groups = list(address.groups())
+            if not groups[0]:
+                groups[0] = '台北市'
+            candidates.append((''.join(groups), groups[1]))
+    return candidates
+
+
+def throughput(func, addresses):
+    start = time.perf_counter()
+    for _ in range(_REPEAT):
+        for a in addresses:
+            func(a)
+    return len(addresses) * _REPEAT / (time.perf_counter() - start)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else _FIXTURE
+    with open(path, encoding='utf-8') as f:
+        addresses = [line.strip() for line in f if line.strip()]
+    cleaned = [address_normalizer.clean_address_text(a) for a in addresses]
+
+    for a in cleaned:
+        assert substitute_address_conjunction(a) == address_normalizer.substitute_conjunctions(a), a
+    for a in addresses:
+        assert previous_candidates(a) == power_web_parser.get_html_address_candidates(a), a
+
+    results = [
+        ('conjunctions, five passes', throughput(substitute_address_conjunction, cleaned)),
+        ('conjunctions, one pass', throughput(address_normalizer.substitute_conjunctions, cleaned)),
+        ('parse address, uncached', throughput(address_normalizer.parse_address.__wrapped__, addresses)),
+        ('parse address, memoized', throughput(location_parser.parse_road_address, addresses)),
+        ('power candidates, previous', throughput(previous_candidates, addresses)),
+        ('power candidates, memoized', throughput(power_web_parser.get_html_address_candidates, addresses)),
+    ]
+    print('%d addresses from %s' % (len(addresses), os.path.basename(path)))
+    for name, rate in results:
+        print('%-28s %12.0f addresses/s' % (name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# coding=utf-8
+""" Time and peak Python memory of streaming a large water outage payload
+into SQLite with one commit per run and with DataImporter.batched_commits.
+The payload of benchmarks/fixtures is replayed by the stub server at the
+given scale; the geocode cache is filled by a first import, so the runs
+measure generation and the database.
+
+    $ python benchmarks/bench_batched_commits.py [--scale 100] [--batch-size 500]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('LDB_URL', 'sqlite://')
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+os.environ.setdefault('LDB_GEOCODE_QPS', '0')
+
+from livelihood_database import livelihood
+from livelihood_database import map_converter
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.geocode_cache import GeocodeCache
+
+from stub_server import StubServer
+
+# Holds the geocode results of every scale, so that the timed runs hit it.
+_GEOCODE_CACHE_CAPACITY = 1000000
+
+
+def run(url, batched_commits, batch_size):
+    directory = tempfile.mkdtemp()
+    connect = DBConnector('sqlite:///' + os.path.join(directory, 'bench.db'))
+    try:
+        connect.create_tables()
+        importer = livelihood.WaterImporter(connect)
+        importer._WATER_SOURCE = url
+        importer.stream = True
+        importer.batch_size = batch_size
+        importer.batched_commits = batched_commits
+        tracemalloc.start()
+        start = time.perf_counter()
+        summary = importer.import_data()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak, summary['inserted']
+    finally:
+        connect._engine.dispose()
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    server = StubServer().start()
+    map_converter.GEOCODE_URL = server.url + '/geocode/json'
+    map_converter.set_cache(GeocodeCache(capacity=_GEOCODE_CACHE_CAPACITY))
+    url = '%s/water?scale=%d' % (server.url, args.scale)
+    try:
+        run(url, False, args.batch_size)
+        for batched_commits in (False, True):
+            elapsed, peak, inserted = run(url, batched_commits, args.batch_size)
+            print('%-14s inserted=%d batch_size=%d time=%.2fs peak=%.1fMB' % (
+                'batched' if batched_commits else 'single commit', inserted, args.batch_size,
+                elapsed, peak / 1e6))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
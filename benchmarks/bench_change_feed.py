@@ -0,0 +1,101 @@
+# coding=utf-8
+""" Compare how a downstream consumer finds out what an import changed: by
+re-reading the event table and diffing it with its previous snapshot, or by
+reading change_feed.changes_since, on SQLite. The import keeps most stored
+events, drops some and adds as many new ones.
+
+    $ python benchmarks/bench_change_feed.py [number_of_events] [changed_ratio]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('LDB_URL', 'sqlite://')
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import change_feed
+from livelihood_database import livelihood
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.dbschema import Event, EventRecord, EventType, event_fingerprint
+
+_INSERT_CHUNK_SIZE = 20000
+
+
+def make_record(i):
+    e = EventRecord(id='%036d' % i, gov_sn='SN%08d' % i, type=EventType.water,
+            city='台北市', district='中正區', detail_addr='羅斯福路%d號' % i,
+            start_date=datetime.date(2017, 6, 1), end_date=datetime.date(2017, 6, 3),
+            description='event %d' % i, coordinates=[(25.0, 121.5)])
+    e.fingerprint = event_fingerprint(e)
+    return e
+
+
+class BenchImporter(livelihood.DataImporter):
+
+    def __init__(self, connect, records):
+        super().__init__(connect)
+        self.records = records
+
+    def get_event_type(self):
+        return EventType.water
+
+    def get_raw_data(self):
+        return self.records
+
+    def generate_events(self, records):
+        return iter(records)
+
+
+def snapshot(connect):
+    session = connect.get_session()
+    rows = {i: (active, update_time) for i, active, update_time in
+            session.query(Event.id, Event.is_active, Event.update_time)}
+    session.close()
+    return rows
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    changed_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    changed = int(size * changed_ratio)
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        connect = DBConnector('sqlite:///' + path)
+        connect.create_tables()
+        first = BenchImporter(connect, [make_record(i) for i in range(size)])
+        start = time.perf_counter()
+        first.import_data()
+        initial = time.perf_counter() - start
+        before = snapshot(connect)
+
+        # Drop the first changed events and add as many new ones.
+        refresh = BenchImporter(connect, [make_record(i) for i in range(changed, size + changed)])
+        start = time.perf_counter()
+        refresh.import_data()
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        after = snapshot(connect)
+        diff = set(i for i, row in after.items() if before.get(i, (None,))[0] != row[0])
+        full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        session = connect.get_session()
+        changes = change_feed.changes_since(session, first.run_id)
+        session.close()
+        feed = time.perf_counter() - start
+
+        assert set(c.event_id for c in changes) == diff
+        print('events=%d changes=%d import=%.2fs refresh=%.2fs reread_and_diff=%.1fms changes_since=%.1fms' % (
+            size, len(changes), initial, elapsed, full * 1e3, feed * 1e3))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# coding=utf-8
+""" Compare asking which active events of a district overlap a date window
+with a query of the event table against event_index.ActiveEventIndex, on
+SQLite with mostly historical (inactive) rows.
+
+    $ python benchmarks/bench_event_index.py [number_of_events] [active_ratio]
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import event_index
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.dbschema import Event, EventType
+
+_DISTRICTS = ('中正區', '大同區', '中山區', '松山區', '大安區', '萬華區', '信義區', '士林區',
+        '北投區', '內湖區', '南港區', '文山區')
+_QUERIES = 1000
+_INSERT_CHUNK_SIZE = 20000
+
+
+def populate(connect, size, active_ratio):
+    """ size events over ten years, the active ones in the last month. """
+    session = connect.get_session()
+    first_day = datetime.date(2007, 6, 1)
+    rows = []
+    for i in range(size):
+        active = random.random() < active_ratio
+        start = first_day + datetime.timedelta(days=3650 - random.randrange(30) if active
+                else random.randrange(3650))
+        rows.append({'id': str(uuid.uuid4()), 'gov_sn': 'SN%08d' % i, 'type': EventType.road,
+            'city': '臺北市', 'district': random.choice(_DISTRICTS),
+            'start_date': start, 'end_date': start + datetime.timedelta(days=random.randrange(7)),
+            'start_time': datetime.time(9), 'end_time': datetime.time(17),
+            'update_time': datetime.datetime(2017, 6, 1), 'is_active': active})
+        if len(rows) == _INSERT_CHUNK_SIZE:
+            session.execute(Event.__table__.insert(), rows)
+            rows = []
+    if rows:
+        session.execute(Event.__table__.insert(), rows)
+    session.commit()
+    session.close()
+
+
+def with_sql(connect, windows):
+    session = connect.get_session()
+    start = time.perf_counter()
+    results = [set(i for (i,) in session.query(Event.id)
+            .filter(Event.is_active == True)
+            .filter(Event.district == district)
+            .filter(Event.start_date <= end)
+            .filter(Event.end_date >= begin)) for begin, end, district in windows]
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed, results
+
+
+def with_index(index, windows):
+    start = time.perf_counter()
+    results = [set(e.id for e in index.overlapping(begin, end, district=district))
+            for begin, end, district in windows]
+    return time.perf_counter() - start, results
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    active_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    random.seed(0)
+    last_month = datetime.date(2017, 5, 1)
+    windows = []
+    for _ in range(_QUERIES):
+        begin = last_month + datetime.timedelta(days=random.randrange(30))
+        windows.append((begin, begin + datetime.timedelta(days=random.randrange(3)),
+                random.choice(_DISTRICTS)))
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        connect = DBConnector('sqlite:///' + path)
+        connect.create_tables()
+        populate(connect, size, active_ratio)
+        index = event_index.ActiveEventIndex(connect)
+        start = time.perf_counter()
+        active = index.refresh()
+        load = time.perf_counter() - start
+        sql, expected = with_sql(connect, windows)
+        indexed, found = with_index(index, windows)
+        assert found == expected
+        print('events=%d active=%d matches=%.1f load=%.1fms sql=%.0fus/query index=%.1fus/query' % (
+            size, active, sum(len(r) for r in found) / len(windows), load * 1e3,
+            sql / len(windows) * 1e6, indexed / len(windows) * 1e6))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
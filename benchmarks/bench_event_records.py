@@ -0,0 +1,75 @@
+# coding=utf-8
+""" Cost per event of building, validating and converting to rows an ORM
+Event with its Coordinate children, compared with an EventRecord.
+
+    $ python benchmarks/bench_event_records.py [number_of_events] [vertices_per_event]
+"""
+
+import datetime
+import os
+import sys
+import time
+import uuid
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database.dbschema import Event, EventRecord, Coordinate, EventType, event_fingerprint
+
+
+def fields(i):
+    return dict(id=str(uuid.uuid4()), type=EventType.water, gov_sn='SN%08d' % i,
+            city='台北市', district='中正區', detail_addr='羅斯福路一段%d號' % i,
+            start_date=datetime.date(2017, 6, 20), end_date=datetime.date(2017, 6, 21),
+            start_time=datetime.time(9), end_time=datetime.time(17),
+            description='進行汰換管線工程')
+
+
+def with_orm(size, vertices):
+    rows = []
+    for i in range(size):
+        e = Event(**fields(i))
+        e.fingerprint = event_fingerprint(e)
+        for k in range(vertices):
+            e.coordinates.append(Coordinate(id=str(uuid.uuid4()),
+                    wgs84_latitude=25.0 + k * 1e-4, wgs84_longitude=121.5 + k * 1e-4))
+        e.is_active = True
+        if e.is_valid():
+            rows.append({c.key: getattr(e, c.key) for c in Event.__table__.columns})
+            for c in e.coordinates:
+                rows.append({'id': c.id, 'latitude': c.wgs84_latitude,
+                    'longitude': c.wgs84_longitude, 'event_id': e.id})
+    return rows
+
+
+def with_records(size, vertices):
+    rows = []
+    for i in range(size):
+        e = EventRecord(coordinates=[(25.0 + k * 1e-4, 121.5 + k * 1e-4) for k in range(vertices)],
+                **fields(i))
+        e.fingerprint = event_fingerprint(e)
+        e.is_active = True
+        if e.is_valid():
+            rows.append(e.to_row())
+            for latitude, longitude in e.coordinates:
+                rows.append({'id': str(uuid.uuid4()), 'latitude': latitude,
+                    'longitude': longitude, 'event_id': e.id})
+    return rows
+
+
+def measure(build, size, vertices):
+    start = time.perf_counter()
+    rows = build(size, vertices)
+    return time.perf_counter() - start, len(rows)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    vertices = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    for name, build in (('orm', with_orm), ('records', with_records)):
+        elapsed, rows = measure(build, size, vertices)
+        print('%-8s events=%d vertices=%d rows=%d %.1fus/event' % (
+            name, size, vertices, rows, elapsed / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# coding=utf-8
+""" Compare storing and reading event shapes as coordinate rows with the
+compact Event.geometry column, on SQLite.
+
+    $ python benchmarks/bench_geometry.py [number_of_events] [vertices_per_event]
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import polyline
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.dbschema import Event, Coordinate, EventType
+
+
+def make_shapes(size, vertices):
+    shapes = {}
+    for i in range(size):
+        latitude, longitude = 25.0 + random.random() * 0.1, 121.5 + random.random() * 0.1
+        shapes[str(uuid.uuid4())] = [(latitude + random.random() * 0.003, longitude + random.random() * 0.003)
+                for _ in range(vertices)]
+    return shapes
+
+
+def populate(connect, shapes, coordinate_rows):
+    now = datetime.datetime(2017, 6, 1)
+    event_rows = []
+    rows = []
+    for i, (event_id, shape) in enumerate(shapes.items()):
+        event_rows.append({'id': event_id, 'gov_sn': 'SN%08d' % i, 'type': EventType.water,
+            'start_date': now.date(), 'end_date': now.date(), 'create_time': now,
+            'update_time': now, 'is_active': True, 'geometry': polyline.encode_polyline(shape)})
+        if coordinate_rows:
+            for latitude, longitude in shape:
+                rows.append({'id': str(uuid.uuid4()), 'latitude': latitude,
+                    'longitude': longitude, 'event_id': event_id})
+    session = connect.get_session()
+    start = time.perf_counter()
+    session.execute(Event.__table__.insert(), event_rows)
+    if rows:
+        session.execute(Coordinate.__table__.insert(), rows)
+    session.commit()
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed
+
+
+def read_coordinate_rows(connect):
+    session = connect.get_session()
+    start = time.perf_counter()
+    shapes = {}
+    for event_id, latitude, longitude in session.query(
+            Coordinate.event_id, Coordinate.wgs84_latitude, Coordinate.wgs84_longitude)\
+            .join(Event, Coordinate.event_id == Event.id)\
+            .filter(Event.is_active == True):
+        shapes.setdefault(event_id, []).append((float(latitude), float(longitude)))
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed, shapes
+
+
+def read_geometry(connect):
+    session = connect.get_session()
+    start = time.perf_counter()
+    shapes = {event_id: polyline.decode_polyline(geometry) for event_id, geometry in
+            session.query(Event.id, Event.geometry).filter(Event.is_active == True)}
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed, shapes
+
+
+def run(shapes, coordinate_rows):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        connect = DBConnector('sqlite:///' + path)
+        connect.create_tables()
+        write = populate(connect, shapes, coordinate_rows)
+        if coordinate_rows:
+            read, read_shapes = read_coordinate_rows(connect)
+        else:
+            read, read_shapes = read_geometry(connect)
+        assert len(read_shapes) == len(shapes)
+        return write, read, os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    vertices = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    random.seed(0)
+    shapes = make_shapes(size, vertices)
+    for coordinate_rows in (True, False):
+        write, read, file_size = run(shapes, coordinate_rows)
+        print('%-16s events=%d vertices=%d write=%.3fs read=%.3fs file=%.1fMB' % (
+            'coordinate rows' if coordinate_rows else 'geometry only', size, vertices,
+            write, read, file_size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# coding=utf-8
+""" Time every stage of an import offline: fetch, parse, coordinate
+conversion, geocoding and the database write of DataImporter.import_data.
+
+The water, road and power payloads and the geocode responses of
+benchmarks/fixtures are replayed by a local stub server (stub_server.py) at
+1x, 10x and 100x their size, and the database is a fresh SQLite file. Results
+are written as JSON, the best of --repeat runs in seconds per stage:
+
+    $ python benchmarks/bench_import.py [--scales 1,10,100] [--repeat 3]
+            [--geocode-latency SECONDS] [--output results.json]
+
+Each stage is timed on its own: the parse and conversion stages run on
+payloads fetched beforehand, geocoding starts from an empty cache, and
+import_data runs with the geocode cache already filled, so that it measures
+record classification, event generation and the database. 'initial' imports
+into an empty database; 'refresh' imports the same payload again, which
+reactivates every stored event. Geocoding from an empty cache dominates the
+run time: 100x issues 12400 geocode requests per repeat.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('LDB_URL', 'sqlite://')
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+# Geocode the stub as fast as it answers unless a quota is asked for.
+os.environ.setdefault('LDB_GEOCODE_QPS', '0')
+
+import sqlalchemy
+
+from livelihood_database import address_normalizer
+from livelihood_database import datetime_parser
+from livelihood_database import fetcher
+from livelihood_database import livelihood
+from livelihood_database import location_parser
+from livelihood_database import map_converter
+from livelihood_database import power_web_parser
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.dbschema import SourceState
+from livelihood_database.geocode_cache import GeocodeCache
+
+from stub_server import StubServer
+
+_SCALES = (1, 10, 100)
+_REPEAT = 3
+
+# Large enough for the geocode queries of every scale, so that runs with a
+# filled cache never evict (the default LRU holds 10000 entries).
+_GEOCODE_CACHE_CAPACITY = 1000000
+
+
+def best_time(func, repeat, setup=None):
+    """ Return (best seconds, result of the last run) of func over repeat
+    runs, calling setup before each run outside of the timing. """
+    best = None
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def clear_parse_caches():
+    address_normalizer.parse_address.cache_clear()
+    power_web_parser._get_address_candidates.cache_clear()
+
+
+def clear_geocode_cache():
+    map_converter.set_cache(GeocodeCache(capacity=_GEOCODE_CACHE_CAPACITY))
+
+
+class Payloads(object):
+    """ The fetched payloads of one scale and the inputs of later stages. """
+
+    def __init__(self, water, road, power_text):
+        self.water = water['result']['results']
+        self.road = road['result']['results']
+        self.power_text = power_text
+        self.power = power_web_parser.parse_html_records(power_text)
+
+    def water_coordinates(self):
+        return [(r['StopWaterSection_wgs84']['coordinates'][0][0][1],
+                r['StopWaterSection_wgs84']['coordinates'][0][0][0]) for r in self.water]
+
+    def road_xy(self):
+        return ([float(r['X']) for r in self.road], [float(r['Y']) for r in self.road])
+
+    def road_coordinates(self):
+        latitudes, longitudes = map_converter.twd97_to_wgs84_batch(*self.road_xy())
+        return [(float(lat), float(lng)) for lat, lng in zip(latitudes, longitudes)]
+
+    def power_addresses(self):
+        addresses = []
+        for record in self.power:
+            candidates = power_web_parser.get_html_address_candidates(record[5])
+            if candidates:
+                addresses.append(candidates[0][0])
+        return addresses
+
+
+def bench_fetch(urls, repeat):
+    """ Download and hash every payload, as fetcher.fetch does on a changed
+    source. """
+    stages = {}
+    responses = {}
+    for name, url in urls.items():
+        stages[name], (responses[name], _) = best_time(
+                lambda: fetcher.fetch(url, name, None), repeat)
+    stages['bytes'] = {name: len(r.content) for name, r in responses.items()}
+    return stages, responses
+
+
+def bench_parse(responses, payloads, addresses, repeat):
+    stages = {}
+    stages['json'], _ = best_time(
+            lambda: (responses['water'].json(), responses['road'].json()), repeat)
+
+    def parse_power():
+        return power_web_parser.parse_html_records(payloads.power_text)
+    stages['power_web_parser'], _ = best_time(parse_power, repeat)
+
+    def parse_dates_and_times():
+        for r in payloads.water:
+            datetime_parser.roc_to_common_date(r['FS_Date'])
+            datetime_parser.roc_to_common_date(r['FC_Date'])
+            datetime_parser.parse_water_road_time(r['Description'])
+        for r in payloads.road:
+            datetime_parser.roc_to_common_date(r['CB_DA'])
+            datetime_parser.roc_to_common_date(r['CE_DA'])
+            datetime_parser.parse_water_road_time(r['CO_TI'])
+    stages['datetime_parser'], _ = best_time(parse_dates_and_times, repeat)
+
+    def parse_locations():
+        for r, address in zip(payloads.water, addresses['water']):
+            location_parser.parse_water_address(address)
+            location_parser.parse_water_description(r['Description'])
+        for address in addresses['road']:
+            location_parser.parse_road_address(address)
+        for record in payloads.power:
+            power_web_parser.get_html_address_candidates(record[5])
+    stages['location_parser'], _ = best_time(parse_locations, repeat, clear_parse_caches)
+    return stages
+
+
+def bench_coordinate_conversion(payloads, repeat):
+    xs, ys = payloads.road_xy()
+    stages = {}
+    stages['twd97_to_wgs84'], _ = best_time(
+            lambda: [map_converter.twd97_to_wgs84(x, y) for x, y in zip(xs, ys)], repeat)
+    stages['twd97_to_wgs84_batch'], _ = best_time(
+            lambda: map_converter.twd97_to_wgs84_batch(xs, ys), repeat)
+    return stages
+
+
+def bench_geocode(server, payloads, repeat):
+    """ Geocode the queries of every importer from an empty cache, then
+    again from the filled cache. """
+    water = payloads.water_coordinates()
+    road = payloads.road_coordinates()
+    power = payloads.power_addresses()
+    stages = {}
+    requests_before = server.geocode_requests
+    stages['water_reverse'], water_addresses = best_time(
+            lambda: map_converter.convert_coordinates_to_addresses(water), repeat, clear_geocode_cache)
+    stages['road_reverse'], road_addresses = best_time(
+            lambda: map_converter.convert_coordinates_to_addresses(road), repeat, clear_geocode_cache)
+    stages['power_forward'], _ = best_time(
+            lambda: map_converter.convert_addresses_to_coordinates(power), repeat, clear_geocode_cache)
+    stages['requests'] = (server.geocode_requests - requests_before) // repeat
+
+    def geocode_all():
+        map_converter.convert_coordinates_to_addresses(water)
+        map_converter.convert_coordinates_to_addresses(road)
+        map_converter.convert_addresses_to_coordinates(power)
+    geocode_all()
+    stages['cached'], _ = best_time(geocode_all, repeat)
+    return stages, {'water': water_addresses, 'road': road_addresses}
+
+
+def bench_import(urls, repeat):
+    """ DataImporter.import_data of every importer on a fresh SQLite file,
+    with the geocode cache filled by a first import. """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    connect = None
+
+    def fresh_database():
+        nonlocal connect
+        if connect is not None:
+            connect._engine.dispose()
+        if os.path.exists(path):
+            os.remove(path)
+        connect = DBConnector('sqlite:///' + path)
+        connect.create_tables()
+
+    def forget_sources():
+        # Make the next import read the payload instead of skipping it as
+        # unchanged.
+        session = connect.get_session()
+        session.query(SourceState).delete()
+        session.commit()
+        session.close()
+
+    importers = {
+        'water': lambda: _importer(livelihood.WaterImporter(connect), '_WATER_SOURCE', urls['water']),
+        'road': lambda: _importer(livelihood.RoadImporter(connect), '_ROAD_SOURCE', urls['road']),
+        'power': lambda: livelihood.PowerImporter(connect, sources=[urls['power']]),
+    }
+    stages = {}
+    try:
+        for name, make_importer in importers.items():
+            fresh_database()
+            make_importer().import_data()
+            stages[name + '_initial'], summary = best_time(
+                    lambda: make_importer().import_data(), repeat, fresh_database)
+            stages[name + '_inserted'] = summary['inserted']
+            stages[name + '_refresh'], _ = best_time(
+                    lambda: make_importer().import_data(), repeat, forget_sources)
+    finally:
+        if connect is not None:
+            connect._engine.dispose()
+        shutil.rmtree(directory)
+    return stages
+
+
+def _importer(importer, attribute, url):
+    setattr(importer, attribute, url)
+    return importer
+
+
+def run(server, scale, repeat):
+    urls = {name: '%s/%s?scale=%d' % (server.url, name, scale)
+            for name in ('water', 'road', 'power')}
+    stages = {}
+    stages['fetch'], responses = bench_fetch(urls, repeat)
+    payloads = Payloads(responses['water'].json(), responses['road'].json(),
+            responses['power'].text)
+    stages['geocode'], addresses = bench_geocode(server, payloads, repeat)
+    stages['parse'] = bench_parse(responses, payloads, addresses, repeat)
+    stages['coordinate_conversion'] = bench_coordinate_conversion(payloads, repeat)
+    stages['import_data'] = bench_import(urls, repeat)
+    return {'scale': scale,
+            'records': {'water': len(payloads.water),
+                        'road': len(payloads.road),
+                        'power': len(payloads.power)},
+            'stages': stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', default=','.join(str(s) for s in _SCALES),
+            help='comma separated payload scales (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=_REPEAT,
+            help='runs per stage, the best is reported (default: %(default)s)')
+    parser.add_argument('--geocode-latency', type=float, default=0,
+            help='seconds added to every geocode response (default: 0)')
+    parser.add_argument('--output', help='write the JSON results to a file instead of stdout')
+    args = parser.parse_args()
+
+    server = StubServer(geocode_latency=args.geocode_latency).start()
+    clear_geocode_cache()
+    map_converter.GEOCODE_URL = server.url + '/geocode/json'
+    report = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'numpy': map_converter.numpy is not None,
+        'repeat': args.repeat,
+        'geocode_latency': args.geocode_latency,
+        'geocode_workers': map_converter.GEOCODE_WORKERS,
+        'geocode_qps': map_converter.rate_limiter.rate,
+        'geocode_cache_capacity': _GEOCODE_CACHE_CAPACITY,
+        'results': [],
+    }
+    try:
+        for scale in (int(s) for s in args.scales.split(',')):
+            print('Scale %dx...' % scale, file=sys.stderr)
+            report['results'].append(run(server, scale, args.repeat))
+    finally:
+        server.stop()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# coding=utf-8
+""" Compare import and query times on SQLite with and without the secondary
+indexes of dbschema.
+
+    $ python benchmarks/bench_indexes.py [number_of_events]
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import func, text
+
+os.environ.setdefault('LDB_URL', 'sqlite://')
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import livelihood
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.dbschema import Event, Coordinate, EventType, event_fingerprint
+
+_COORDINATES_PER_EVENT = 3
+_IMPORTED_EVENTS = 2000
+_QUERIES = 50
+
+
+def make_event(i, event_type, start_date):
+    e = Event(id='%036d' % i, gov_sn='SN%08d' % i, type=event_type,
+            city='台北市', district='中正區', detail_addr='羅斯福路%d號' % i,
+            start_date=start_date, end_date=start_date + datetime.timedelta(days=3),
+            start_time=datetime.time(9), end_time=datetime.time(17),
+            description='event %d' % i)
+    e.fingerprint = event_fingerprint(e)
+    for k in range(_COORDINATES_PER_EVENT):
+        e.coordinates.append(Coordinate(id='%030d-%05d' % (i, k),
+                wgs84_latitude=25.0 + random.random() * 0.1,
+                wgs84_longitude=121.5 + random.random() * 0.1))
+    return e
+
+
+def populate(connect, size):
+    first_day = datetime.date(2013, 1, 1)
+    now = datetime.datetime(2017, 6, 1)
+    event_rows = []
+    coordinate_rows = []
+    for i in range(size):
+        e = make_event(i, list(EventType)[i % 3], first_day + datetime.timedelta(days=i % 1800))
+        event_rows.append({'id': e.id, 'gov_sn': e.gov_sn, 'type': e.type, 'city': e.city,
+            'district': e.district, 'detail_addr': e.detail_addr, 'start_date': e.start_date,
+            'end_date': e.end_date, 'start_time': e.start_time, 'end_time': e.end_time,
+            'description': e.description, 'create_time': now, 'update_time': now,
+            'is_active': i % 10 == 0, 'fingerprint': e.fingerprint})
+        for c in e.coordinates:
+            coordinate_rows.append({'id': c.id, 'latitude': c.wgs84_latitude,
+                'longitude': c.wgs84_longitude, 'event_id': e.id})
+
+    session = connect.get_session()
+    session.execute(Event.__table__.insert(), event_rows)
+    session.execute(Coordinate.__table__.insert(), coordinate_rows)
+    session.commit()
+    session.close()
+
+
+def drop_secondary_indexes(connect):
+    session = connect.get_session()
+    for table in (Event.__table__, Coordinate.__table__):
+        for index in table.indexes:
+            if not index.unique:
+                session.execute(text('DROP INDEX %s' % index.name))
+    session.commit()
+    session.close()
+
+
+class BenchImporter(livelihood.DataImporter):
+
+    def __init__(self, connect, events):
+        super().__init__(connect)
+        self.events = events
+
+    def get_event_type(self):
+        return EventType.water
+
+    def get_raw_data(self):
+        return self.events
+
+    def generate_events(self, source):
+        return iter(source)
+
+
+def time_import(connect):
+    # Half of the payload already exists in the table, half is new.
+    events = [make_event(i, EventType.water, datetime.date(2013, 1, 1) + datetime.timedelta(days=i % 1800))
+            for i in range(0, _IMPORTED_EVENTS * 3, 6)]
+    # Number the new events after both the stored ones and the payload's.
+    session = connect.get_session()
+    first_new = max(int(session.query(func.max(Event.id)).scalar() or -1),
+            max(int(e.id) for e in events)) + 1
+    session.close()
+    events += [make_event(first_new + i, EventType.water, datetime.date(2017, 6, 1))
+            for i in range(_IMPORTED_EVENTS // 2)]
+    start = time.perf_counter()
+    BenchImporter(connect, events).import_data()
+    return time.perf_counter() - start
+
+
+def time_date_range_query(connect):
+    session = connect.get_session()
+    start = time.perf_counter()
+    for q in range(_QUERIES):
+        first = datetime.date(2013, 1, 1) + datetime.timedelta(days=q * 30)
+        last = first + datetime.timedelta(days=14)
+        events = session.query(Event)\
+                .filter(Event.is_active == True)\
+                .filter(Event.start_date <= last)\
+                .filter(Event.end_date >= first)\
+                .all()
+        for e in events:
+            e.coordinates
+        session.expunge_all()
+    elapsed = (time.perf_counter() - start) / _QUERIES
+    session.close()
+    return elapsed
+
+
+def run(size, indexed):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        connect = DBConnector('sqlite:///' + path)
+        connect.create_tables()
+        if not indexed:
+            drop_secondary_indexes(connect)
+        populate(connect, size)
+        return {'import_seconds': time_import(connect),
+                'date_range_query_seconds': time_date_range_query(connect)}
+    finally:
+        os.remove(path)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(0)
+    for indexed in (False, True):
+        result = run(size, indexed)
+        print('%-16s events=%d import=%.3fs date_range_query=%.4fs' % (
+            'with indexes' if indexed else 'without indexes', size,
+            result['import_seconds'], result['date_range_query_seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# coding=utf-8
+""" Compare the sequential batch loop of DataImporter.import_data with the
+asyncio pipeline (DataImporter.pipeline) on the water and road payloads of
+benchmarks/fixtures, replayed by the stub server with geocode latency and
+imported into a fresh SQLite file with an empty geocode cache.
+
+    $ python benchmarks/bench_pipeline.py [--scale 10] [--batch-size 50]
+            [--geocode-latency 0.005] [--write-latency 0]
+
+--write-latency adds seconds to the write of every batch, standing in for a
+slow or remote database.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault('LDB_URL', 'sqlite://')
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+os.environ.setdefault('LDB_GEOCODE_QPS', '0')
+
+from livelihood_database import livelihood
+from livelihood_database import map_converter
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.geocode_cache import GeocodeCache
+
+from stub_server import StubServer
+
+
+def run(importer_class, attribute, url, pipeline, batch_size, write_latency):
+    directory = tempfile.mkdtemp()
+    connect = DBConnector('sqlite:///' + os.path.join(directory, 'bench.db'))
+    try:
+        connect.create_tables()
+        map_converter.set_cache(GeocodeCache())
+        importer = importer_class(connect)
+        setattr(importer, attribute, url)
+        importer.pipeline = pipeline
+        importer.batch_size = batch_size
+        if write_latency:
+            write_batch = importer._write_batch
+
+            def slow_write_batch(*args):
+                time.sleep(write_latency)
+                return write_batch(*args)
+            importer._write_batch = slow_write_batch
+        start = time.perf_counter()
+        summary = importer.import_data()
+        return time.perf_counter() - start, summary['inserted'], importer.metrics.stages
+    finally:
+        connect._engine.dispose()
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--geocode-latency', type=float, default=0.005)
+    parser.add_argument('--write-latency', type=float, default=0)
+    args = parser.parse_args()
+
+    server = StubServer(geocode_latency=args.geocode_latency).start()
+    map_converter.GEOCODE_URL = server.url + '/geocode/json'
+    try:
+        for name, importer_class, attribute in (
+                ('water', livelihood.WaterImporter, '_WATER_SOURCE'),
+                ('road', livelihood.RoadImporter, '_ROAD_SOURCE')):
+            url = '%s/%s?scale=%d' % (server.url, name, args.scale)
+            for pipeline in (False, True):
+                elapsed, inserted, stages = run(importer_class, attribute, url, pipeline,
+                        args.batch_size, args.write_latency)
+                print('%-5s %-10s inserted=%d total=%.3fs generate=%.3fs write=%.3fs' % (
+                    name, 'pipeline' if pipeline else 'sequential', inserted, elapsed,
+                    stages.get('generate', 0), stages.get('write', 0)))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# coding=utf-8
+""" Compare the lxml XPath power bulletin parser with the previous
+BeautifulSoup parser on a bulletin page, without geocoding.
+
+    $ python benchmarks/bench_power_parser.py [page.html ...]
+
+Requires beautifulsoup4 for the previous parser.
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from bs4 import BeautifulSoup
+
+from livelihood_database import power_web_parser
+
+_FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'power_bulletin.html')
+_REPEAT = 50
+
+
+def parse_with_beautifulsoup(text):
+    """ The parser before lxml XPath: full tree, date re-parsed per row. """
+    html_soup = BeautifulSoup(text, 'lxml')
+    records = []
+    for rows in html_soup.find_all(class_='PowerCutTable'):
+        table_date = rows.caption
+        table_content = rows.find_all('td')
+        i = 0
+        while i != len(table_content):
+            date_info = power_web_parser.get_html_date(table_date.contents[0])
+            start_time_info = power_web_parser.get_html_start_time(table_content[i].contents[0])
+            end_time_info = power_web_parser.get_html_end_time(table_content[i].contents[2])
+            sn_info, description_info = power_web_parser.get_html_serial_number_description(
+                    table_content[i+1].contents[0])
+            records.append((date_info, start_time_info, end_time_info, sn_info,
+                description_info, str(table_content[i+1].contents[2])))
+            i += 2
+    return records
+
+
+def parse_with_xpath(text):
+    return list(power_web_parser.iter_html_records(text))
+
+
+def measure(parse, text):
+    start = time.perf_counter()
+    for _ in range(_REPEAT):
+        records = parse(text)
+    return (time.perf_counter() - start) / _REPEAT, records
+
+
+def main():
+    for path in sys.argv[1:] or [_FIXTURE]:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        before, expected = measure(parse_with_beautifulsoup, text)
+        after, records = measure(parse_with_xpath, text)
+        assert records == expected, 'parsers disagree on %s' % path
+        print('%s: %d records, beautifulsoup=%.2fms xpath=%.2fms speedup=%.1fx' % (
+            os.path.basename(path), len(records), before * 1000, after * 1000, before / after))
+
+
+if __name__ == '__main__':
+    main()
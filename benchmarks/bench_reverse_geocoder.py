@@ -0,0 +1,98 @@
+# coding=utf-8
+""" Load time, lookup time and share of points answered locally by
+reverse_geocoder.ReverseGeocoder, on synthetic district boundaries (a grid
+of rectangles over Taipei) and address points.
+
+    $ python benchmarks/bench_reverse_geocoder.py [number_of_address_points] [max_distance]
+"""
+
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database.reverse_geocoder import ReverseGeocoder
+
+_DISTRICTS = ('中正區', '大同區', '中山區', '松山區', '大安區', '萬華區', '信義區', '士林區',
+        '北投區', '內湖區', '南港區', '文山區')
+_SOUTH, _WEST = 24.96, 121.45
+_ROWS, _COLUMNS = 3, 4
+_DISTRICT_SIZE = 0.05
+_STREET_SPACING = 0.002
+_QUERIES = 20000
+
+
+def district_at(latitude, longitude):
+    row = int((latitude - _SOUTH) / _DISTRICT_SIZE)
+    column = int((longitude - _WEST) / _DISTRICT_SIZE)
+    return _DISTRICTS[row * _COLUMNS + column]
+
+
+def random_point():
+    return (_SOUTH + random.random() * _ROWS * _DISTRICT_SIZE,
+            _WEST + random.random() * _COLUMNS * _DISTRICT_SIZE)
+
+
+def write_boundaries(path):
+    features = []
+    for row in range(_ROWS):
+        for column in range(_COLUMNS):
+            south, west = _SOUTH + row * _DISTRICT_SIZE, _WEST + column * _DISTRICT_SIZE
+            north, east = south + _DISTRICT_SIZE, west + _DISTRICT_SIZE
+            features.append({'type': 'Feature',
+                'properties': {'COUNTYNAME': '臺北市', 'TOWNNAME': _DISTRICTS[row * _COLUMNS + column]},
+                'geometry': {'type': 'Polygon', 'coordinates': [[[west, south], [east, south],
+                    [east, north], [west, north], [west, south]]]}})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f, ensure_ascii=False)
+
+
+def write_addresses(path, size):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['latitude', 'longitude', 'address'])
+        for i in range(size):
+            latitude, longitude = random_point()
+            street = int((latitude - _SOUTH) / _STREET_SPACING)
+            writer.writerow(['%.6f' % latitude, '%.6f' % longitude, '台北市%s第%d路%d號' % (
+                district_at(latitude, longitude), street, i)])
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    max_distance = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    random.seed(0)
+    directory = tempfile.mkdtemp()
+    boundaries_path = os.path.join(directory, 'districts.json')
+    addresses_path = os.path.join(directory, 'addresses.csv')
+    try:
+        write_boundaries(boundaries_path)
+        write_addresses(addresses_path, size)
+        geocoder = ReverseGeocoder(boundaries_path, addresses_path, max_distance)
+        start = time.perf_counter()
+        geocoder.load()
+        load = time.perf_counter() - start
+
+        points = [random_point() for _ in range(_QUERIES)]
+        start = time.perf_counter()
+        addresses = [geocoder.reverse(latitude, longitude) for latitude, longitude in points]
+        lookup = (time.perf_counter() - start) / len(points)
+
+        answered = [(p, a) for p, a in zip(points, addresses) if a is not None]
+        for (latitude, longitude), address in answered:
+            assert address.startswith('台北市' + district_at(latitude, longitude)), address
+        print('address_points=%d max_distance=%.0fm load=%.2fs lookup=%.1fus answered=%.1f%%' % (
+            size, max_distance, load, lookup * 1e6, 100.0 * len(answered) / len(points)))
+    finally:
+        os.remove(boundaries_path)
+        os.remove(addresses_path)
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
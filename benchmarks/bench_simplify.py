@@ -0,0 +1,36 @@
+# coding=utf-8
+""" Vertices kept and time spent simplifying the water outage sections of a
+data.taipei payload at several tolerances.
+
+    $ python benchmarks/bench_simplify.py [water_outage.json]
+"""
+
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import map_converter
+
+_FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'water_outage.json')
+_TOLERANCES = (0.5, 1, 2, 5, 10)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else _FIXTURE
+    with open(path, encoding='utf-8') as f:
+        records = json.load(f)['result']['results']
+    rings = [[(c[1], c[0]) for c in r['StopWaterSection_wgs84']['coordinates'][0]] for r in records]
+    raw = sum(len(ring) for ring in rings)
+    for tolerance in _TOLERANCES:
+        start = time.perf_counter()
+        kept = sum(len(map_converter.simplify_coordinates(ring, tolerance)) for ring in rings)
+        elapsed = time.perf_counter() - start
+        print('tolerance=%4.1fm rings=%d vertices=%d kept=%d (%.0f%%) %.1fus/ring' % (
+            tolerance, len(rings), raw, kept, 100.0 * kept / raw, elapsed / len(rings) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# coding=utf-8
+""" Compare answering "which active events are within a radius of a point"
+with a full scan of the event table against spatial.events_near, on SQLite,
+and check that a point inside a polygon away from its vertices matches it.
+
+    $ python benchmarks/bench_spatial.py [number_of_events] [vertices_per_event] [radius_m]
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault('GOOGLE_GEO_KEY', '')
+
+from livelihood_database import polyline
+from livelihood_database import spatial
+from livelihood_database.dbconnector import DBConnector
+from livelihood_database.dbschema import Event, EventCell, Coordinate, EventType
+
+_QUERIES = 20
+_INSERT_CHUNK_SIZE = 20000
+
+
+def populate(connect, size, vertices):
+    """ size events around Taipei, one in ten of them inactive, each a
+    closed ring of vertices coordinates. """
+    now = datetime.datetime(2017, 6, 1)
+    session = connect.get_session()
+    event_rows = []
+    rows = []
+    cell_rows = []
+    for i in range(size):
+        event_id = str(uuid.uuid4())
+        latitude, longitude = 24.9 + random.random() * 0.3, 121.4 + random.random() * 0.3
+        ring = [(latitude + random.random() * 0.003, longitude + random.random() * 0.003)
+                for _ in range(max(vertices - 1, 1))]
+        ring = polyline.decode_polyline(polyline.encode_polyline(ring + ring[:1]))
+        event_rows.append({'id': event_id, 'gov_sn': 'SN%08d' % i, 'type': EventType.water,
+            'start_date': now.date(), 'end_date': now.date(), 'create_time': now,
+            'update_time': now, 'is_active': i % 10 != 0,
+            'geometry': polyline.encode_polyline(ring)})
+        for vertex in ring:
+            rows.append({'id': str(uuid.uuid4()), 'latitude': vertex[0], 'longitude': vertex[1],
+                'event_id': event_id, 'cell': spatial.grid_cell(*vertex)})
+        cell_rows.extend({'event_id': event_id, 'cell': cell} for cell in spatial.shape_cells(ring))
+        if len(rows) >= _INSERT_CHUNK_SIZE:
+            insert(session, event_rows, rows, cell_rows)
+            event_rows, rows, cell_rows = [], [], []
+    if event_rows:
+        insert(session, event_rows, rows, cell_rows)
+    session.commit()
+    session.close()
+
+
+def insert(session, event_rows, rows, cell_rows):
+    session.execute(Event.__table__.insert(), event_rows)
+    session.execute(Coordinate.__table__.insert(), rows)
+    session.execute(EventCell.__table__.insert(), cell_rows)
+
+
+def full_scan(session, latitude, longitude, radius_m):
+    near = set()
+    for event_id, geometry in session.query(Event.id, Event.geometry).filter(Event.is_active == True):
+        coordinates = polyline.decode_polyline(geometry)
+        if min(spatial.distance(latitude, longitude, coordinates),
+                min(spatial.haversine(latitude, longitude, *c) for c in coordinates)) <= radius_m:
+            near.add(event_id)
+    return near
+
+
+def with_index(session, latitude, longitude, radius_m):
+    return set(e.id for e, _ in spatial.events_near(session, latitude, longitude, radius_m))
+
+
+def check_interior_point(connect):
+    """ A polygon spanning several grid cells matches a point in its middle,
+    away from its vertices and edges, and a point beside an edge. """
+    now = datetime.datetime(2017, 6, 1)
+    ring = [(25.0, 121.5), (25.0, 121.55), (25.05, 121.55), (25.05, 121.5), (25.0, 121.5)]
+    session = connect.get_session()
+    insert(session, [{'id': 'polygon', 'gov_sn': 'POLYGON', 'type': EventType.water,
+        'start_date': now.date(), 'end_date': now.date(), 'create_time': now, 'update_time': now,
+        'is_active': True, 'geometry': polyline.encode_polyline(ring)}],
+        [{'id': str(uuid.uuid4()), 'latitude': v[0], 'longitude': v[1], 'event_id': 'polygon',
+            'cell': spatial.grid_cell(*v)} for v in ring],
+        [{'event_id': 'polygon', 'cell': cell} for cell in spatial.shape_cells(ring)])
+    session.commit()
+
+    inside = [(e.id, d) for e, d in spatial.events_near(session, 25.025, 121.525, 50) if e.id == 'polygon']
+    assert inside == [('polygon', 0.0)], inside
+    beside = [d for e, d in spatial.events_near(session, 25.025, 121.551, 200) if e.id == 'polygon']
+    assert len(beside) == 1 and 90 < beside[0] < 112, beside
+    assert not [e for e, _ in spatial.events_near(session, 25.025, 121.552, 100) if e.id == 'polygon']
+    assert 'polygon' in [e.id for e in spatial.events_in_bbox(session, 25.02, 121.52, 25.03, 121.53)]
+    session.execute(EventCell.__table__.delete().where(EventCell.event_id == 'polygon'))
+    session.execute(Coordinate.__table__.delete().where(Coordinate.event_id == 'polygon'))
+    session.execute(Event.__table__.delete().where(Event.id == 'polygon'))
+    session.commit()
+    session.close()
+
+
+def measure(connect, query, points, radius_m):
+    session = connect.get_session()
+    start = time.perf_counter()
+    results = [query(session, latitude, longitude, radius_m) for latitude, longitude in points]
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed / len(points), results
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    vertices = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    radius_m = float(sys.argv[3]) if len(sys.argv) > 3 else 500
+    random.seed(0)
+    points = [(24.9 + random.random() * 0.3, 121.4 + random.random() * 0.3) for _ in range(_QUERIES)]
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        connect = DBConnector('sqlite:///' + path)
+        connect.create_tables()
+        check_interior_point(connect)
+        populate(connect, size, vertices)
+        scan, expected = measure(connect, full_scan, points, radius_m)
+        indexed, found = measure(connect, with_index, points, radius_m)
+        assert found == expected
+        print('events=%d coordinates=%d radius=%.0fm matches=%.1f full_scan=%.1fms events_near=%.2fms' % (
+            size, size * vertices, radius_m, sum(len(r) for r in found) / len(points),
+            scan * 1e3, indexed * 1e3))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# coding=utf-8
+""" Record the live payloads of data.taipei and Taipower, and the Geocoding
+API responses to the queries of the importers, into benchmarks/fixtures for
+stub_server.py. Requires network access and GOOGLE_GEO_KEY.
+
+    $ GOOGLE_GEO_KEY=<key> python benchmarks/record_fixtures.py
+"""
+
+import json
+import os
+import urllib.parse
+
+os.environ.setdefault('LDB_URL', 'sqlite://')
+
+from livelihood_database import livelihood
+from livelihood_database import map_converter
+from livelihood_database import power_web_parser
+
+from bench_import import Payloads
+from stub_server import FIXTURES
+
+
+def get(url):
+    response = map_converter.session.get(url)
+    response.raise_for_status()
+    return response
+
+
+def geocode(query):
+    return get('%s?%s&sensor=false&language=zh-tw&key=%s' % (
+            map_converter.GEOCODE_URL, urllib.parse.urlencode(query), map_converter.KEY)).json()
+
+
+def save(name, text):
+    with open(os.path.join(FIXTURES, name), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def main():
+    water = get(livelihood.WaterImporter._WATER_SOURCE)
+    road = get(livelihood.RoadImporter._ROAD_SOURCE)
+    power = get(livelihood.PowerImporter._POWER_SOURCE)
+    save('water_outage.json', water.text)
+    save('road_construction.json', road.text)
+    save('power_bulletin.html', power.text)
+
+    payloads = Payloads(water.json(), road.json(), power.text)
+    recorded = {'latlng': {}, 'address': {}}
+    for latitude, longitude in payloads.water_coordinates() + payloads.road_coordinates():
+        key = '%.5f,%.5f' % (latitude, longitude)
+        recorded['latlng'][key] = geocode({'latlng': '%s,%s' % (latitude, longitude)})
+    for record in payloads.power:
+        for address, _ in power_web_parser.get_html_address_candidates(record[5]):
+            recorded['address'][address] = geocode({'address': address})
+    save('geocode.json', json.dumps(recorded, ensure_ascii=False, indent=1, sort_keys=True))
+    print('Recorded %d water, %d road and %d power records, %d geocode responses' % (
+        len(payloads.water), len(payloads.road), len(payloads.power),
+        len(recorded['latlng']) + len(recorded['address'])))
+
+
+if __name__ == '__main__':
+    main()
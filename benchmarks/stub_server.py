@@ -0,0 +1,234 @@
+# coding=utf-8
+""" Local HTTP server replaying the recorded payloads of benchmarks/fixtures
+in place of data.taipei, Taipower and the Google Geocoding API.
+
+    /water?scale=N    water outage JSON
+    /road?scale=N     road construction JSON
+    /power?scale=N    power outage bulletin HTML
+    /geocode/json     Geocoding API (address=... or latlng=...)
+
+Payloads are scaled by appending N - 1 replicas of every record with their
+own identifiers, coordinates and house numbers, so that a scaled payload has
+N times as many distinct events and geocode queries. Geocode queries that
+were not recorded are answered with the recorded response of the nearest
+coordinate or, for addresses, a recorded OK response chosen by hash.
+
+    $ python benchmarks/stub_server.py [port]
+"""
+
+import bisect
+import copy
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Offset between the coordinates of consecutive replicas, in degrees. Larger
+# than the geocode cache precision so that replicas are geocoded separately.
+_REPLICA_OFFSET = 0.0001
+
+_POWER_TABLE_PATTERN = re.compile('<table class="PowerCutTable".*?</table>\s*', re.DOTALL)
+_POWER_SN_PATTERN = re.compile('(<td class="info">[A-Z\da-z]+)')
+_POWER_NUMBER_PATTERN = re.compile('(<td class="info">[^<]*<br />（[^\d，]*)(\d+)(號)')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def scale_water(payload, scale):
+    results = payload['result']['results']
+    scaled = list(results)
+    for r in range(1, scale):
+        for record in results:
+            record = copy.deepcopy(record)
+            record['SW_No'] = '%s-%d' % (record['SW_No'], r)
+            for ring in record['StopWaterSection_wgs84']['coordinates']:
+                for vertex in ring:
+                    vertex[0] = round(vertex[0] + r * _REPLICA_OFFSET, 7)
+                    vertex[1] = round(vertex[1] + r * _REPLICA_OFFSET, 7)
+            scaled.append(record)
+    return _with_results(payload, scaled)
+
+
+def scale_road(payload, scale):
+    results = payload['result']['results']
+    scaled = list(results)
+    for r in range(1, scale):
+        for record in results:
+            record = dict(record)
+            record['AC_NO'] = '%s-%d' % (record['AC_NO'], r)
+            # About _REPLICA_OFFSET degrees, in TWD97 metres.
+            record['X'] = '%.3f' % (float(record['X']) + r * 10)
+            record['Y'] = '%.3f' % (float(record['Y']) + r * 10)
+            scaled.append(record)
+    return _with_results(payload, scaled)
+
+
+def _with_results(payload, results):
+    payload = dict(payload)
+    payload['result'] = dict(payload['result'], count=len(results), results=results)
+    return payload
+
+
+def scale_power(page, scale):
+    tables = _POWER_TABLE_PATTERN.findall(page)
+    if not tables or scale <= 1:
+        return page
+    replicas = []
+    for r in range(1, scale):
+        for table in tables:
+            table = _POWER_SN_PATTERN.sub(lambda m: '%s%03d' % (m.group(1), r), table)
+            table = _POWER_NUMBER_PATTERN.sub(
+                    lambda m: '%s%d%s' % (m.group(1), int(m.group(2)) + 1000 * r, m.group(3)), table)
+            replicas.append(table)
+    end = page.rfind(tables[-1]) + len(tables[-1])
+    return page[:end] + ''.join(replicas) + page[end:]
+
+
+class GeocodeReplay(object):
+    """ Recorded Geocoding API responses, keyed by the address or by the
+    coordinate rounded to 5 decimal places. """
+
+    def __init__(self, recorded):
+        self.addresses = recorded['address']
+        self._address_keys = sorted(key for key, response in self.addresses.items()
+                if response['status'] == 'OK')
+        self.coordinates = recorded['latlng']
+        self._points = sorted((tuple(float(v) for v in key.split(',')), key)
+                for key in self.coordinates)
+        self._latitudes = [p[0][0] for p in self._points]
+
+    def address(self, address):
+        response = self.addresses.get(address)
+        if response is None:
+            digest = hashlib.sha1(address.encode('utf-8')).digest()
+            key = self._address_keys[int.from_bytes(digest[:4], 'big') % len(self._address_keys)]
+            response = self.addresses[key]
+        return response
+
+    def coordinate(self, latitude, longitude):
+        response = self.coordinates.get('%.5f,%.5f' % (latitude, longitude))
+        if response is None:
+            response = self.coordinates[self._nearest(latitude, longitude)]
+        return response
+
+    def _nearest(self, latitude, longitude):
+        # The recorded points are few; scan outwards from the latitude.
+        i = bisect.bisect_left(self._latitudes, latitude)
+        best = None
+        for (lat, lng), key in self._points[max(0, i - 8):i + 8] or self._points:
+            distance = (lat - latitude) ** 2 + (lng - longitude) ** 2
+            if best is None or distance < best[0]:
+                best = (distance, key)
+        return best[1]
+
+
+class StubServer(object):
+    """ Serve the fixtures on 127.0.0.1 from a background thread.
+
+    geocode_latency is the delay, in seconds, added to every geocode
+    response to model the round trip to the Geocoding API.
+    """
+
+    def __init__(self, port=0, geocode_latency=0):
+        self.geocode_latency = geocode_latency
+        self.geocode_requests = 0
+        self._water = json.loads(load_fixture('water_outage.json'))
+        self._road = json.loads(load_fixture('road_construction.json'))
+        self._power = load_fixture('power_bulletin.html')
+        self._geocode = GeocodeReplay(json.loads(load_fixture('geocode.json')))
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def payload(self, path, scale):
+        """ The body and content type served for path at scale. """
+        key = (path, scale)
+        with self._lock:
+            if key not in self._payloads:
+                if path == '/water':
+                    body = json.dumps(scale_water(self._water, scale), ensure_ascii=False)
+                    content_type = 'application/json; charset=utf-8'
+                elif path == '/road':
+                    body = json.dumps(scale_road(self._road, scale), ensure_ascii=False)
+                    content_type = 'application/json; charset=utf-8'
+                elif path == '/power':
+                    body = scale_power(self._power, scale)
+                    content_type = 'text/html; charset=utf-8'
+                else:
+                    return None
+                self._payloads[key] = (body.encode('utf-8'), content_type)
+            return self._payloads[key]
+
+    def geocode(self, query):
+        with self._lock:
+            self.geocode_requests += 1
+        if self.geocode_latency:
+            time.sleep(self.geocode_latency)
+        if 'latlng' in query:
+            latitude, longitude = query['latlng'][0].split(',')
+            return self._geocode.coordinate(float(latitude), float(longitude))
+        return self._geocode.address(query.get('address', [''])[0])
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                if url.path == '/geocode/json':
+                    body = json.dumps(stub.geocode(query), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    payload = stub.payload(url.path, int(query.get('scale', ['1'])[0]))
+                    if payload is None:
+                        self.send_error(404)
+                        return
+                    body, content_type = payload
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    server = StubServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print('Serving fixtures on %s' % server.url)
+    server._server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# coding=utf-8
+
+import functools
+import re
+
+# Bound of the memoized parsing results.
+CACHE_SIZE = 4096
+
+ADDRESS_REGEX = '(?:\d*)?(?:台灣)?((?:.*?市)?)((?:.*?區)?)((?:.*?(?:路|街|大道|橋))?(?:[一二三四五六七八九十\d]*?段)?(?:\d*?巷)?(?:\d*?弄)?(?:[-\d]*?號)?)(?:.*)'
+
+address_pattern = re.compile(ADDRESS_REGEX)
+
+# Conjunctions in house number ranges and lists, e.g. 1之3號, 5至9號, 2、4號,
+# and their replacement when they follow a digit. Elsewhere they are dropped.
+_CONJUNCTIONS = {
+    '－': '-', '之': '-',
+    '至': '號', '及': '號', '號': '號',
+    '．': '號', '‧': '號', '、': '號', '／': '號', '/': '號', '～': '號', '~': '號',
+}
+_SEPARATORS = set('．‧、／/～~')
+_CONJUNCTION_PATTERN = re.compile('[%s]' % re.escape(''.join(_CONJUNCTIONS)))
+_SPACE_PATTERN = re.compile('\s|（|）')
+
+
+def substitute(sub_before, sub_after, address_str, delete_flag):
+    """ Replace sub_before by sub_after where it follows a numeric character.
+    Elsewhere (except at the start) it is removed, or, with delete_flag, the
+    other way around: replaced where it does not follow a numeric character. """
+    return re.sub(re.escape(sub_before),
+            lambda m: _substitute_match(m, sub_after, delete_flag), address_str)
+
+
+def _substitute_match(match, sub_after, delete_flag):
+    i = match.start()
+    if i == 0:
+        return match.group()
+    follows_number = match.string[i-1].isnumeric()
+    if delete_flag:
+        return match.group() if follows_number else sub_after
+    return sub_after if follows_number else ''
+
+
+def substitute_conjunctions(address):
+    """ Normalize the conjunctions of an address in one pass; same result as
+    substituting －, 之, 至 and 及, then the separators and then 號 in turn. """
+    return _CONJUNCTION_PATTERN.sub(_substitute_conjunction, address)
+
+
+def _substitute_conjunction(match):
+    i = match.start()
+    c = match.group()
+    if i == 0:
+        return '號' if c in _SEPARATORS else c
+    if match.string[i-1].isnumeric():
+        return _CONJUNCTIONS[c]
+    return ''
+
+
+def clean_address_text(raw_address):
+    """ Remove whitespace and full-width parentheses. """
+    return _SPACE_PATTERN.sub('', raw_address)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_address(address):
+    """ (city, district, detail address) groups of an address, or None. """
+    match = address_pattern.search(address)
+    if match:
+        return match.groups()
+    return None
+
+
+def normalize_addresses(addresses):
+    return [substitute_conjunctions(clean_address_text(a)) for a in addresses]
+
+
+def parse_addresses(addresses):
+    return [parse_address(a) for a in addresses]
@@ -0,0 +1,51 @@
+# coding=utf-8
+
+""" Read-side feed of the changes made to the event table by the importers.
+
+Every import run that writes events is recorded in import_run, and every
+event it inserts, reactivates or deactivates in event_change. A consumer
+keeps the id of the last run it processed and asks for what changed since:
+
+    changes = change_feed.changes_since(session, last_run_id)
+    for change in changes:
+        process(change.event_id, change.kind)
+    if changes:
+        last_run_id = changes[-1].run_id
+
+Runs are numbered when they start writing. changes_since stops before the
+first run still running, so that a run finishing after a later one is not
+skipped, and returns whole runs only.
+
+This module only depends on dbschema, so consumers can use it without the
+importers' environment (LDB_URL, GOOGLE_GEO_KEY). """
+
+from sqlalchemy import func
+
+from .dbschema import EventChange, ImportRun
+
+
+def changes_since(session, run_id=0):
+    """ The EventChange rows of the finished runs after run_id, ordered by
+    run and then in the order they were made. """
+    query = session.query(EventChange).filter(EventChange.run_id > run_id)
+    running = _first_running(session, run_id)
+    if running is not None:
+        query = query.filter(EventChange.run_id < running)
+    return query.order_by(EventChange.run_id, EventChange.id).all()
+
+
+def latest_run_id(session):
+    """ The id of the last run whose changes changes_since returns, to start
+    following the feed from now on; 0 if there is none. """
+    query = session.query(func.max(ImportRun.id)).filter(ImportRun.finish_time != None)
+    running = _first_running(session, 0)
+    if running is not None:
+        query = query.filter(ImportRun.id < running)
+    return query.scalar() or 0
+
+
+def _first_running(session, run_id):
+    return session.query(func.min(ImportRun.id))\
+            .filter(ImportRun.id > run_id)\
+            .filter(ImportRun.finish_time == None)\
+            .scalar()
@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from . import dbschema
+from . import migration
 
 
 class DBConnector(object):
@@ -12,5 +13,22 @@ class DBConnector(object):
     def create_tables(self):
         dbschema.Base.metadata.create_all(self._engine)
 
+    def ensure_indexes(self):
+        migration.create_missing_indexes(self._engine)
+
     def get_session(self):
         return self._Session()
+
+    def upgrade_tables(self):
+        """ Bring a database created by an older version up to dbschema. """
+        dbschema.Base.metadata.create_all(self._engine)
+        migration.add_missing_columns(self._engine)
+        session = self.get_session()
+        try:
+            migration.backfill_fingerprints(session)
+            migration.backfill_geometry(session)
+            migration.backfill_cells(session)
+            migration.backfill_event_cells(session)
+        finally:
+            session.close()
+        self.ensure_indexes()
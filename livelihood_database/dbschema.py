@@ -1,5 +1,6 @@
 # encoding: utf-8
 import enum
+import hashlib
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import CHAR
@@ -8,6 +9,8 @@ from sqlalchemy import DateTime
 from sqlalchemy import Enum
 from sqlalchemy import FetchedValue
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
+from sqlalchemy import Integer
 from sqlalchemy import Numeric
 from sqlalchemy import String
 from sqlalchemy import Text
@@ -15,6 +18,8 @@ from sqlalchemy import Time
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
+from . import polyline
+
 
 Base = declarative_base()
 
@@ -25,6 +30,12 @@ class EventType(enum.Enum):
     road = 3
 
 
+class ChangeKind(enum.Enum):
+    inserted = 1
+    reactivated = 2
+    deactivated = 3
+
+
 class Event(Base):
     __tablename__ = 'event'
 
@@ -32,6 +43,10 @@ class Event(Base):
             'detail_addr', 'start_date', 'end_date', 'start_time', 'end_time',
             'description', 'update_time', 'affected_areas'])
 
+    # Fields that identify an event, hashed into its fingerprint.
+    _FINGERPRINT_FIELDS = ('gov_sn', 'type', 'city', 'district', 'detail_addr',
+            'start_date', 'end_date', 'start_time', 'end_time', 'description')
+
     # columns
     id = Column(CHAR(36), primary_key=True)
     gov_sn = Column(String(30), nullable=False)
@@ -47,16 +62,90 @@ class Event(Base):
     create_time = Column(DateTime, server_default=FetchedValue())
     update_time = Column(DateTime, server_default=FetchedValue())
     is_active = Column(Boolean, nullable=False)
+    fingerprint = Column(CHAR(40))
+    source_key = Column(CHAR(40))
+    # The coordinates of the event as an encoded polyline (see polyline.py).
+    geometry = Column(Text)
 
     # relationships
     coordinates = relationship('Coordinate', back_populates='event')
 
+    # indexes
+    __table_args__ = (
+        Index('ux_event_fingerprint', 'fingerprint', unique=True),
+        Index('ix_event_type_active', 'type', 'is_active', 'update_time'),
+        Index('ix_event_gov_sn', 'gov_sn'),
+        Index('ix_event_date_range', 'start_date', 'end_date'),
+        Index('ix_event_source_key', 'source_key'),
+    )
+
     def is_valid(self):
         for c in Event.__table__.columns:
             if not c.nullable and self.__dict__[c.name] is None:
                 return False
         return True
 
+    def get_coordinates(self):
+        """ The (latitude, longitude) pairs of the event, decoded from
+        geometry, or read from its coordinate rows if it has no geometry. """
+        if self.geometry is not None:
+            return polyline.decode_polyline(self.geometry)
+        return [(float(c.wgs84_latitude), float(c.wgs84_longitude)) for c in self.coordinates]
+
+
+def event_fingerprint(e):
+    """ SHA-1 of the identifying fields of an Event (or of any row with the
+    same attribute names). """
+    values = []
+    for name in Event._FINGERPRINT_FIELDS:
+        value = getattr(e, name)
+        if value is None:
+            values.append('\0')
+        elif isinstance(value, enum.Enum):
+            values.append(value.name)
+        elif hasattr(value, 'isoformat'):
+            values.append(value.isoformat())
+        else:
+            values.append(str(value))
+    return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+class EventRecord(object):
+    """ Lightweight, uninstrumented event produced by generate_events and
+    converted to rows only when written. It has an attribute per column of
+    Event, plus coordinates, a list of (latitude, longitude) pairs. """
+
+    _COLUMNS = tuple(c.key for c in Event.__table__.columns)
+
+    # Columns that may not be None, computed once instead of per event.
+    _REQUIRED_FIELDS = tuple(c.key for c in Event.__table__.columns if not c.nullable)
+
+    __slots__ = _COLUMNS + ('coordinates',)
+
+    def __init__(self, **values):
+        for name in self._COLUMNS:
+            setattr(self, name, values.pop(name, None))
+        self.coordinates = values.pop('coordinates', None) or []
+        if values:
+            raise TypeError('Unknown event fields: %s' % ', '.join(values))
+
+    @classmethod
+    def from_event(cls, e):
+        """ The record of an Event instance. """
+        record = cls(**{name: getattr(e, name) for name in cls._COLUMNS})
+        record.coordinates = [(c.wgs84_latitude, c.wgs84_longitude) for c in e.coordinates]
+        return record
+
+    def is_valid(self):
+        for name in self._REQUIRED_FIELDS:
+            if getattr(self, name) is None:
+                return False
+        return True
+
+    def to_row(self):
+        """ The row of the event table, as a dict for Core inserts. """
+        return {name: getattr(self, name) for name in self._COLUMNS}
+
 
 class Coordinate(Base):
     __tablename__ = 'coordinate'
@@ -66,6 +155,82 @@ class Coordinate(Base):
     wgs84_latitude = Column('latitude', Numeric(precision=13, scale=10), nullable=False)
     wgs84_longitude = Column('longitude', Numeric(precision=13, scale=10), nullable=False)
     event_id = Column('event_id', CHAR(36), ForeignKey('event.id'), nullable=False)
+    # Grid cell of the vertex (see spatial.grid_cell).
+    cell = Column(Integer)
 
     # relationships
     event = relationship('Event', back_populates='coordinates')
+
+    # indexes
+    __table_args__ = (
+        Index('ix_coordinate_event_id', 'event_id'),
+        # Covers the bounding box queries of the spatial module.
+        Index('ix_coordinate_cell', 'cell', 'latitude', 'longitude', 'event_id'),
+    )
+
+
+class EventCell(Base):
+    """ A grid cell (see spatial.grid_cell) crossed or covered by the shape
+    of an event with more than one coordinate. """
+    __tablename__ = 'event_cell'
+
+    # columns
+    id = Column(Integer, primary_key=True)
+    event_id = Column(CHAR(36), ForeignKey('event.id'), nullable=False)
+    cell = Column(Integer, nullable=False)
+
+    # indexes
+    __table_args__ = (
+        # Covers the shape queries of the spatial module.
+        Index('ix_event_cell_cell', 'cell', 'event_id'),
+    )
+
+
+class SourceState(Base):
+    """ Validators and content hash of the last successfully imported payload
+    of a data source, used to skip unchanged sources. """
+    __tablename__ = 'source_state'
+
+    # columns
+    url = Column(String(255), primary_key=True)
+    etag = Column(String(255))
+    last_modified = Column(String(64))
+    content_hash = Column(CHAR(40))
+    update_time = Column(DateTime)
+
+
+class ImportRun(Base):
+    """ A run of DataImporter.import_data that wrote to the event table. A
+    run is finished once its status is 'ok' or 'failed'; while it is
+    'running', changes_since stops before it. """
+    __tablename__ = 'import_run'
+
+    # columns
+    id = Column(Integer, primary_key=True)
+    type = Column(Enum(EventType), nullable=False)
+    status = Column(String(10), nullable=False)
+    start_time = Column(DateTime, nullable=False)
+    finish_time = Column(DateTime)
+
+    # indexes
+    __table_args__ = (
+        Index('ix_import_run_finish_time', 'finish_time'),
+    )
+
+
+class EventChange(Base):
+    """ Append-only log of the events inserted, reactivated (made active
+    again) and deactivated by each import run. """
+    __tablename__ = 'event_change'
+
+    # columns
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey('import_run.id'), nullable=False)
+    event_id = Column(CHAR(36), ForeignKey('event.id'), nullable=False)
+    kind = Column(Enum(ChangeKind), nullable=False)
+    change_time = Column(DateTime, nullable=False)
+
+    # indexes
+    __table_args__ = (
+        Index('ix_event_change_run_id', 'run_id'),
+    )
@@ -0,0 +1,195 @@
+# coding=utf-8
+
+""" In-memory index of the active events, for overlap queries by date and
+time window and by city and district without querying the event table.
+
+The index loads the active events once and answers from interval trees, so
+a lookup costs microseconds however many inactive rows the table holds.
+Register it as an import listener to drop it after every import that
+may have changed the events; it is reloaded on the next query:
+
+    index = event_index.ActiveEventIndex(connect)
+    livelihood.DataImporter.listeners.append(index)
+    index.overlapping(date(2017, 6, 1), date(2017, 6, 7), district='中正區')
+
+Importers running in other processes cannot notify it; call invalidate()
+after they finish. """
+
+from collections import namedtuple
+import datetime
+import logging
+import threading
+import time
+
+from . import metrics
+from .dbschema import Event
+
+logger = logging.getLogger(__name__)
+
+# An active event, with start and end as datetimes: the start or end date
+# at its start or end time, or at the start or end of the day if the time
+# is unknown.
+ActiveEvent = namedtuple('ActiveEvent', ['id', 'type', 'gov_sn', 'city', 'district',
+        'detail_addr', 'start', 'end', 'description'])
+
+
+class IntervalTree(object):
+    """ Static interval tree of closed [start, end] intervals.
+
+    The intervals are kept sorted by start; the sorted array is read as an
+    implicit balanced binary tree, whose node at the middle of a range
+    knows the largest end in the range. A query skips the ranges ending
+    before it and the nodes starting after it. """
+
+    def __init__(self, intervals):
+        """ intervals is an iterable of (start, end, item). """
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in intervals]
+        self._ends = [interval[1] for interval in intervals]
+        self._items = [interval[2] for interval in intervals]
+        self._max_ends = list(self._ends)
+        if intervals:
+            self._build(0, len(intervals))
+
+    def _build(self, lo, hi):
+        mid = (lo + hi) // 2
+        if lo < mid:
+            self._max_ends[mid] = max(self._max_ends[mid], self._build(lo, mid))
+        if mid + 1 < hi:
+            self._max_ends[mid] = max(self._max_ends[mid], self._build(mid + 1, hi))
+        return self._max_ends[mid]
+
+    def __len__(self):
+        return len(self._items)
+
+    def overlapping(self, start, end):
+        """ The items of the intervals overlapping [start, end], by start. """
+        found = []
+        stack = [(0, len(self._items))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_ends[mid] < start:
+                continue
+            stack.append((lo, mid))
+            # Nothing starting after end overlaps.
+            if self._starts[mid] <= end:
+                if self._ends[mid] >= start:
+                    found.append(mid)
+                stack.append((mid + 1, hi))
+        found.sort()
+        return [self._items[i] for i in found]
+
+
+class ActiveEventIndex(metrics.ImportListener):
+    """ The active events of a database in interval trees: one of all of
+    them, and one per city, per district and per (city, district). """
+
+    def __init__(self, connect):
+        self.connect = connect
+        # When the index was last loaded, as time.time().
+        self.load_time = None
+        self._trees = None
+        # Bumped by invalidate(), so that a load started before does not
+        # store the events it read.
+        self._generation = 0
+        # Held while loading.
+        self._lock = threading.Lock()
+        # Held while changing _trees and _generation.
+        self._state_lock = threading.Lock()
+
+    def import_finished(self, importer, metrics):
+        # A failed run that started writing may have committed some of its
+        # batches (with batched_commits).
+        if metrics.status == 'ok' or (metrics.status == 'failed' and importer.run_id is not None):
+            self.invalidate()
+
+    def invalidate(self):
+        """ Drop the index; the next query reloads it. """
+        with self._state_lock:
+            self._generation += 1
+            self._trees = None
+
+    def refresh(self):
+        """ Load the active events now. Return their number. """
+        with self._lock:
+            trees = self._load()
+        tree = trees.get((None, None))
+        return len(tree) if tree is not None else 0
+
+    def _load(self):
+        """ Load the trees and return them. They are kept unless the index
+        was invalidated meanwhile, since they may predate the change. """
+        start = time.perf_counter()
+        generation = self._generation
+        session = self.connect.get_session()
+        try:
+            rows = session.query(Event.id, Event.type, Event.gov_sn, Event.city, Event.district,
+                    Event.detail_addr, Event.start_date, Event.end_date, Event.start_time,
+                    Event.end_time, Event.description)\
+                    .filter(Event.is_active == True)\
+                    .all()
+        finally:
+            session.close()
+
+        groups = {}
+        for row in rows:
+            e = ActiveEvent(row.id, row.type, row.gov_sn, row.city, row.district,
+                    row.detail_addr, _start_datetime(row.start_date, row.start_time),
+                    _end_datetime(row.end_date, row.end_time), row.description)
+            interval = (e.start, e.end, e)
+            for key in set(((None, None), (e.city, None), (None, e.district), (e.city, e.district))):
+                groups.setdefault(key, []).append(interval)
+        trees = {key: IntervalTree(intervals) for key, intervals in groups.items()}
+
+        with self._state_lock:
+            if generation == self._generation:
+                self._trees = trees
+                self.load_time = time.time()
+        logger.debug('Loaded %d active events in %.3fs', len(rows), time.perf_counter() - start)
+        return trees
+
+    def _get_trees(self):
+        trees = self._trees
+        if trees is None:
+            with self._lock:
+                trees = self._trees
+                if trees is None:
+                    # Answer this query even if the trees are not kept.
+                    trees = self._load()
+        return trees
+
+    def overlapping(self, start=None, end=None, city=None, district=None, event_type=None):
+        """ The active events, as ActiveEvent sorted by start, whose
+        [start, end] overlaps the given window.
+
+        start and end are datetimes or dates (a date covers the whole day),
+        None for an open end. city and district narrow the events to a
+        city, a district (of any city) or both; event_type to an
+        EventType. """
+        if start is None:
+            start = datetime.datetime.min
+        elif not isinstance(start, datetime.datetime):
+            start = _start_datetime(start, None)
+        if end is None:
+            end = datetime.datetime.max
+        elif not isinstance(end, datetime.datetime):
+            end = _end_datetime(end, None)
+
+        tree = self._get_trees().get((city, district))
+        if tree is None:
+            return []
+        events = tree.overlapping(start, end)
+        if event_type is not None:
+            events = [e for e in events if e.type == event_type]
+        return events
+
+
+def _start_datetime(day, time_of_day):
+    return datetime.datetime.combine(day, time_of_day or datetime.time.min)
+
+
+def _end_datetime(day, time_of_day):
+    return datetime.datetime.combine(day, time_of_day or datetime.time.max)
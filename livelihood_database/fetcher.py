@@ -0,0 +1,145 @@
+# coding=utf-8
+
+import codecs
+import hashlib
+import json
+import logging
+import re
+import requests
+
+from .dbschema import SourceState
+
+logger = logging.getLogger(__name__)
+
+# Returned instead of a response when the source has not changed since the
+# last successful import.
+UNCHANGED = object()
+
+# Pooled connections shared by every importer.
+session = requests.Session()
+
+
+def fetch(url, name, state, stream=False):
+    """ Conditional GET of a data source.
+
+    state is the SourceState of the last successful import of url, or None.
+    Return (response, new_state): response is UNCHANGED if neither the
+    validators nor the content hash changed, and None if the request failed.
+    new_state is the SourceState to store once the payload is imported.
+
+    With stream=True the body is not downloaded up front: the response is
+    wrapped so that reading it through iter_content() fills in the content
+    hash of new_state, and only the validators can short-circuit the fetch.
+    """
+    headers = {}
+    if state is not None:
+        if state.etag:
+            headers['If-None-Match'] = state.etag
+        if state.last_modified:
+            headers['If-Modified-Since'] = state.last_modified
+
+    response = session.get(url, headers=headers, stream=stream)
+    if response.status_code == 304:
+        logger.info('Web (%s) is not modified.', name)
+        return (UNCHANGED, None)
+    elif response.status_code != 200:
+        logger.warning('Web (%s) request is NOT ok. Response status code = %s.',
+            name, response.status_code)
+        return (None, None)
+
+    new_state = SourceState(url=url,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'))
+    if stream:
+        logger.info('Web (%s) request is ok.', name)
+        return (_HashingResponse(response, new_state), new_state)
+
+    new_state.content_hash = hashlib.sha1(response.content).hexdigest()
+    if state is not None and state.content_hash == new_state.content_hash:
+        logger.info('Web (%s) content is unchanged.', name)
+        return (UNCHANGED, None)
+
+    logger.info('Web (%s) request is ok.', name)
+    return (response, new_state)
+
+
+def iter_json_array(response, key, chunk_size=64 * 1024):
+    """ Yield the elements of the first JSON array named key in a streamed
+    response one at a time, e.g. key='results' for the data.taipei payload
+    {"result": {..., "results": [...]}}. Only the element being decoded is
+    held in memory. Raise ValueError if the payload has no such array or
+    ends before the array does, e.g. an error payload. """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = response.iter_content(chunk_size)
+    start_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    buffer = ''
+    eof = False
+
+    def read():
+        try:
+            return text_decoder.decode(next(chunks))
+        except StopIteration:
+            return None
+
+    # Find the start of the array.
+    while True:
+        match = start_pattern.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = read()
+        if chunk is None:
+            raise ValueError('No JSON array "%s" in the payload' % key)
+        # Keep a tail long enough to hold a key split across chunks.
+        buffer = buffer[-(len(key) + 64):] + chunk
+
+    pos = 0
+    while True:
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            # Read the rest of the payload so that it is fully hashed.
+            for _ in chunks:
+                pass
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            # A value not followed by a delimiter may be truncated (e.g. a
+            # number split across chunks).
+            complete = eof or (end < len(buffer) and
+                    (buffer[end].isspace() or buffer[end] in ',]'))
+        except ValueError:
+            complete = False
+
+        if complete:
+            yield element
+            buffer = buffer[end:]
+            pos = 0
+        elif eof:
+            raise ValueError('Truncated JSON array "%s"' % key)
+        else:
+            chunk = read()
+            if chunk is None:
+                eof = True
+            else:
+                buffer = buffer[pos:] + chunk
+                pos = 0
+
+
+class _HashingResponse(object):
+    """ Streamed response whose content hash is stored in state once it has
+    been read to the end. """
+
+    def __init__(self, response, state):
+        self._response = response
+        self._state = state
+
+    def iter_content(self, chunk_size=1):
+        digest = hashlib.sha1()
+        for chunk in self._response.iter_content(chunk_size):
+            digest.update(chunk)
+            yield chunk
+        self._state.content_hash = digest.hexdigest()
@@ -0,0 +1,125 @@
+# coding=utf-8
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+_DEFAULT_CAPACITY = 10000
+_DEFAULT_TTL = 30 * 24 * 60 * 60
+_DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+_DEFAULT_PRECISION = 5
+
+_CREATE_TABLE_SQL = 'CREATE TABLE IF NOT EXISTS geocode_cache ' \
+        '(key TEXT PRIMARY KEY, value TEXT, expire_time REAL NOT NULL)'
+
+
+class GeocodeCache(object):
+    """ Two-level cache of geocode results: an in-process LRU in front of an
+    optional persistent SQLite store.
+
+    Values must be JSON serializable. A value of None is a negative entry
+    (e.g. ZERO_RESULTS) and expires after `negative_ttl` seconds instead of
+    `ttl` seconds.
+    """
+
+    def __init__(self, path=None, capacity=_DEFAULT_CAPACITY, ttl=_DEFAULT_TTL,
+            negative_ttl=_DEFAULT_NEGATIVE_TTL, precision=_DEFAULT_PRECISION):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(_CREATE_TABLE_SQL)
+            self._db.commit()
+
+    @classmethod
+    def from_environ(cls):
+        return cls(path=os.environ.get('LDB_GEOCODE_CACHE'),
+                capacity=int(os.environ.get('LDB_GEOCODE_CACHE_SIZE', _DEFAULT_CAPACITY)),
+                ttl=int(os.environ.get('LDB_GEOCODE_TTL', _DEFAULT_TTL)),
+                negative_ttl=int(os.environ.get('LDB_GEOCODE_NEGATIVE_TTL', _DEFAULT_NEGATIVE_TTL)),
+                precision=int(os.environ.get('LDB_GEOCODE_PRECISION', _DEFAULT_PRECISION)))
+
+    def address_key(self, address_name):
+        address = unicodedata.normalize('NFKC', address_name)
+        return 'address:' + ''.join(address.split()).lower()
+
+    def coordinate_key(self, latitude, longitude):
+        return 'latlng:%.*f,%.*f' % (self.precision, float(latitude),
+                self.precision, float(longitude))
+
+    def lookup(self, key):
+        """ Return (True, value) on a hit and (False, None) on a miss. """
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                        'SELECT value, expire_time FROM geocode_cache WHERE key = ?',
+                        (key,)).fetchone()
+                if row:
+                    entry = (row[1], json.loads(row[0]))
+                    self._remember(key, entry)
+
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._forget(key)
+                self.misses += 1
+                return (False, None)
+
+            self._lru.move_to_end(key)
+            self.hits += 1
+            return (True, entry[1])
+
+    def store(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        entry = (time.time() + ttl, value)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                        'INSERT OR REPLACE INTO geocode_cache (key, value, expire_time) VALUES (?, ?, ?)',
+                        (key, json.dumps(value), entry[0]))
+                self._db.commit()
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, v in self._lru.items() if v[0] < now]:
+                del self._lru[key]
+            if self._db is not None:
+                self._db.execute('DELETE FROM geocode_cache WHERE expire_time < ?', (now,))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM geocode_cache')
+                self._db.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._lru)}
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def _forget(self, key):
+        self._lru.pop(key, None)
+        if self._db is not None:
+            self._db.execute('DELETE FROM geocode_cache WHERE key = ?', (key,))
+            self._db.commit()
@@ -1,8 +1,15 @@
 # coding=utf-8
 
 from abc import ABCMeta, abstractmethod
+import asyncio
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 from datetime import datetime, timezone, timedelta
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
 import shutil
 import time
@@ -10,23 +17,86 @@ import urllib.parse
 import uuid
 import zipfile
 import requests
+from sqlalchemy import and_, bindparam, func, literal, or_
+from sqlalchemy.exc import DataError, IntegrityError
 
+from . import fetcher
 from . import map_converter
 from . import datetime_parser
 from . import location_parser
+from . import metrics
 from . import power_web_parser
+from . import spatial
 from .dbconnector import DBConnector
-from .dbschema import Event, Coordinate, EventType
+from .dbschema import Event, EventRecord, Coordinate, EventType, SourceState, event_fingerprint
+from .dbschema import ChangeKind, EventCell, EventChange, ImportRun
+from .rate_limiter import RateLimiter
 
 LDB_URL = os.environ['LDB_URL']
 TZ = timezone(timedelta(hours=8))
 
+logger = logging.getLogger(__name__)
+
+# Upper bound of ids in a single IN clause, below SQLite's variable limit.
+_BULK_CHUNK_SIZE = 500
+
+# Events of a batch to insert, ids of stored events to reactivate and the
+# source keys to store for some of them, as handed from generate to write.
+GeneratedBatch = namedtuple('GeneratedBatch', ['new_events', 'reactivate_ids', 'source_key_updates'])
+
 class DataImporter(object):
     __metaclass__ = ABCMeta
 
-    def __init__(self):
-        self.connect = DBConnector(LDB_URL)
+    # Number of records classified, geocoded and written at a time.
+    batch_size = 500
+
+    # Read JSON sources incrementally, a batch of records at a time. Memory
+    # is bounded by a batch with batched_commits only: otherwise the events
+    # of every batch are generated before the first one is written, so that
+    # the write transaction is not held open across geocode requests, which
+    # would lock other writers out of SQLite meanwhile.
+    stream = False
+
+    # Read, generate and write batches concurrently in an asyncio pipeline
+    # (see _run_pipeline), with at most pipeline_queue_size batches waiting
+    # between two stages. Without batched_commits the write transaction then
+    # stays open while the next batches are geocoded, so on SQLite other
+    # importers cannot write until the run is committed. import_data called
+    # from a running event loop (which asyncio.run cannot nest in) ignores
+    # it and runs the batches one after another.
+    pipeline = False
+    pipeline_queue_size = 2
+
+    # Commit after every batch instead of once per run, so that the session
+    # holds one batch at a time, and write each batch in a savepoint, so that
+    # an event the database rejects is logged and skipped instead of failing
+    # the run. Events not seen are still deactivated in one transaction at
+    # the end of a successful run.
+    batched_commits = False
+
+    # Seconds after which a run still marked running in import_run is taken
+    # for the run of an importer that died: the next run of the same type
+    # marks it failed, so that change_feed readers stop waiting for it. Keep
+    # it above the longest import, or overlapping runs would close each
+    # other while they are still writing.
+    stale_run_timeout = float(os.environ.get('LDB_STALE_RUN_TIMEOUT', 6 * 60 * 60))
+
+    # Store a coordinate row per vertex besides Event.geometry. Readers that
+    # use Event.geometry only can turn this off.
+    write_coordinates = True
+
+    # metrics.ImportListener instances notified of every run. Shared by all
+    # importers unless an importer is given its own list.
+    listeners = metrics.default_listeners()
+
+    def __init__(self, connect=None):
+        self.connect = connect or DBConnector(LDB_URL)
         self.session = self.connect.get_session()
+        self._source_states = []
+        # metrics.ImportMetrics of the current or last import_data run.
+        self.metrics = None
+        # Id of the import_run row of the current or last run that wrote.
+        self.run_id = None
 
     @abstractmethod
     def get_event_type(self):
@@ -36,91 +106,521 @@ class DataImporter(object):
     def get_raw_data(self):
         pass
 
+    def get_records(self, source):
+        """ Split the raw data into records, one per event. """
+        return source
+
+    def get_source_key(self, record):
+        """ Hash of a record as published by the source, including its
+        government identifiers. Records whose key is already stored are
+        reactivated without generating (and geocoding) their events. """
+        content = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1((self.get_event_type().name + content).encode('utf-8')).hexdigest()
+
+    def _located_source_key(self, record, location_info, coordinates=()):
+        """ get_source_key of a record, or None if its location could not be
+        geocoded or parsed, so that the record is generated (and geocoded)
+        again by the next run instead of keeping the failed location. """
+        if not any(location_info):
+            return None
+        if any(c is None for coordinate in coordinates for c in coordinate):
+            return None
+        return self.get_source_key(record)
+
     @abstractmethod
-    def generate_events(self, source):
+    def generate_events(self, records):
+        """ Yield an EventRecord (or, more slowly, an Event) per record. """
         pass
 
+    def fetch(self, url, name, stream=False):
+        """ Fetch a data source for get_raw_data. Return the response, None if
+        the request failed, or fetcher.UNCHANGED if the source is unchanged
+        since its last successful import. """
+        response, new_state = fetcher.fetch(url, name, self._get_source_state(url), stream)
+        if new_state is not None:
+            self._source_states.append(new_state)
+        return response
+
+    def _get_source_state(self, url):
+        return self.session.query(SourceState)\
+                .filter(SourceState.url == url)\
+                .first()
+
+    def fetch_json(self, url, name, key='results'):
+        """ Fetch a JSON source. Return the decoded payload or, in stream
+        mode, an iterator over the elements of its array named key. """
+        response = self.fetch(url, name, self.stream)
+        if response is None or response is fetcher.UNCHANGED:
+            return response
+        if self.stream:
+            return fetcher.iter_json_array(response, key)
+        return response.json()
+
     def import_data(self):
-        source = self.get_raw_data()
+        """ Import the data source. Return a summary of the run, also kept
+        with timings per stage and more counts in self.metrics:
+
+        stages: fetch (get_raw_data, including parse for power outages),
+            load (stored keys), classify (source keys of records), generate
+            (generate_events and validation, including geocode and, for
+            water outages, simplify), write, deactivate and commit.
+        counts: records, new_records, generated, invalid, inserted,
+            reactivated and deactivated events, failed_rows (events
+            rejected by the database with batched_commits), raw_vertices and
+            simplified_vertices of water outages, and the geocode_requests,
+            geocode_cache_hits, geocode_failures, location_parse_failures
+            and power_parse_failures of the run.
+        """
+        self.metrics = metrics.ImportMetrics(self.get_event_type().name)
+        self.run_id = None
+        status = 'failed'
+        try:
+            with metrics.counting(self.metrics):
+                summary = self._import_data()
+            if summary is None:
+                status = 'skipped'
+            elif summary['unchanged']:
+                status = 'unchanged'
+            else:
+                status = 'ok'
+            return summary
+        finally:
+            if status == 'failed':
+                self._fail_run()
+            self.metrics.finish(status)
+            self._notify('import_finished', self.metrics)
+
+    def _import_data(self):
+        with self._stage('fetch'):
+            source = self.get_raw_data()
+        if source is fetcher.UNCHANGED:
+            # Keep the active events as they are.
+            self.session.close()
+            return {'unchanged': True}
         if not source:
             return
 
-        self._set_events_inactive()
+        with self._stage('load'):
+            # Every event seen in this run is stamped with update_time, so the
+            # ones not stamped can be deactivated afterwards in one statement.
+            update_time = self._new_update_time()
+
+            known_sources = self._load_source_keys()
+            existing = self._load_existing_events()
+
+            self.run_id = self._start_run(update_time)
+        existed_ids = set()
+        inserted_ids = set()
+        batches = _batches(self.get_records(source), self.batch_size)
+        pipeline = self.pipeline
+        if pipeline and _event_loop_running():
+            logger.warning('An event loop is running; importing without the pipeline')
+            pipeline = False
+        if pipeline:
+            inserted = asyncio.run(self._run_pipeline(batches, known_sources, existing,
+                    inserted_ids, existed_ids, update_time))
+        elif self.batched_commits:
+            # Every batch is committed, releasing the database, before the
+            # next one is generated.
+            inserted = 0
+            for records in batches:
+                batch = self._generate_batch(records, known_sources, existing, inserted_ids)
+                inserted += self._write_batch(batch, existed_ids, update_time)
+        else:
+            # Geocode everything before the first write opens the transaction.
+            generated = [self._generate_batch(records, known_sources, existing, inserted_ids)
+                    for records in batches]
+            inserted = 0
+            for batch in generated:
+                inserted += self._write_batch(batch, existed_ids, update_time)
+
+        with self._stage('deactivate'):
+            deactivated = self._set_events_inactive(update_time)
+        self.metrics.count('deactivated', deactivated)
+
+        with self._stage('commit'):
+            for state in self._source_states:
+                state.update_time = update_time
+                self.session.merge(state)
+            self._source_states = []
+            self._finish_run('ok')
+
+            self.session.commit()
+            self.session.close()
+
+        return {'unchanged': False,
+                'run_id': self.run_id,
+                'inserted': inserted,
+                'existing': len(existed_ids),
+                'deactivated': deactivated}
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        """ Time the with block as stage name of the current run. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.metrics is not None:
+                seconds = time.perf_counter() - start
+                self.metrics.add_stage(name, seconds)
+                self._notify('stage_finished', name, seconds)
+
+    def _count(self, name, n=1):
+        """ Add n to count name of the current run. """
+        if self.metrics is not None:
+            self.metrics.count(name, n)
+
+    def _notify(self, method, *args):
+        for listener in self.listeners:
+            try:
+                getattr(listener, method)(self, *args)
+            except Exception:
+                logger.exception('Import listener %r failed', listener)
+
+    def _generate_batch(self, records, known_sources, existing, inserted_ids):
+        """ Classify a batch of records and generate the events of the new
+        ones. Return a GeneratedBatch to pass to _write_batch.
+
+        known_sources and existing map source keys and fingerprints to event
+        ids and are updated with the events to insert, whose ids are added
+        to inserted_ids. Records repeating an event inserted in this run are
+        not reactivated. """
+
+        # Records already stored are only reactivated; new or changed
+        # records go through generate_events.
+        with self._stage('classify'):
+            new_records = []
+            reactivate_ids = set()
+            for record in records:
+                source_key = self.get_source_key(record)
+                if source_key in known_sources:
+                    if known_sources[source_key] not in inserted_ids:
+                        reactivate_ids.add(known_sources[source_key])
+                else:
+                    new_records.append(record)
+
+        with self._stage('generate'):
+            new_events = []
+            source_key_updates = {}
+            generated = invalid = 0
+            for e in self.generate_events(new_records):
+                generated += 1
+                if isinstance(e, Event):
+                    e = EventRecord.from_event(e)
+                e.is_active = True
+                if not e.is_valid():
+                    invalid += 1
+                    continue
+                if e.fingerprint is None:
+                    e.fingerprint = event_fingerprint(e)
+                if e.fingerprint not in existing:
+                    existing[e.fingerprint] = e.id
+                    inserted_ids.add(e.id)
+                    new_events.append(e)
+                elif existing[e.fingerprint] not in inserted_ids:
+                    reactivate_ids.add(existing[e.fingerprint])
+                    if e.source_key is not None:
+                        source_key_updates[existing[e.fingerprint]] = e.source_key
+                if e.source_key is not None:
+                    known_sources[e.source_key] = existing[e.fingerprint]
+
+        self.metrics.count('records', len(records))
+        self.metrics.count('new_records', len(new_records))
+        self.metrics.count('generated', generated)
+        self.metrics.count('invalid', invalid)
+        return GeneratedBatch(new_events, reactivate_ids, source_key_updates)
+
+    def _write_batch(self, batch, existed_ids, update_time):
+        """ Write a GeneratedBatch and return the number of inserted events.
+        existed_ids collects the ids of existing events seen so far in this
+        run. """
+        reactivate_ids = batch.reactivate_ids - existed_ids
+        existed_ids |= reactivate_ids
+
+        with self._stage('write'):
+            if self.batched_commits:
+                inserted = self._write_isolated(batch.new_events, update_time)
+                with self.session.begin_nested():
+                    self._reactivate_events(reactivate_ids, update_time)
+                    self._update_source_keys(batch.source_key_updates)
+                self.session.commit()
+                self.session.expunge_all()
+            else:
+                self._insert_events(batch.new_events, update_time)
+                self._reactivate_events(reactivate_ids, update_time)
+                self._update_source_keys(batch.source_key_updates)
+                inserted = len(batch.new_events)
+
+        self.metrics.count('inserted', inserted)
+        self.metrics.count('reactivated', len(reactivate_ids))
+        return inserted
+
+    def _write_isolated(self, events, update_time):
+        """ Insert events in a savepoint. If the database rejects one of
+        them, roll the savepoint back and insert them one at a time, each in
+        its own savepoint, logging and skipping the rejected ones. Return
+        the number of inserted events. """
+        try:
+            with self.session.begin_nested():
+                self._insert_events(events, update_time)
+            return len(events)
+        except (IntegrityError, DataError) as error:
+            logger.warning('Batch of %d events failed to insert (%s), inserting them one by one',
+                    len(events), error.orig)
+
+        inserted = 0
+        for e in events:
+            try:
+                with self.session.begin_nested():
+                    self._insert_events([e], update_time)
+                inserted += 1
+            except (IntegrityError, DataError) as error:
+                self._count('failed_rows')
+                logger.warning('Event %s (%s) failed to insert: %s', e.gov_sn, e.id, error.orig)
+        return inserted
+
+    async def _run_pipeline(self, batches, known_sources, existing, inserted_ids, existed_ids,
+            update_time):
+        """ Read, generate and write the batches as three concurrent stages
+        connected by queues of pipeline_queue_size batches: the next batches
+        are read and generated (and geocoded) while one is written, and a
+        slow database stalls the stages before it once the queues are full.
+        Reading and generating run in threads; writing runs in the event
+        loop's thread, which also loaded the session. Return the number of
+        inserted events. """
+        loop = asyncio.get_running_loop()
+        records_queue = asyncio.Queue(self.pipeline_queue_size)
+        events_queue = asyncio.Queue(self.pipeline_queue_size)
+
+        async def read(executor):
+            while True:
+                records = await loop.run_in_executor(executor, metrics.in_context(next),
+                        batches, None)
+                await records_queue.put(records)
+                if records is None:
+                    return
+
+        async def generate(executor):
+            while True:
+                records = await records_queue.get()
+                if records is None:
+                    await events_queue.put(None)
+                    return
+                await events_queue.put(await loop.run_in_executor(
+                        executor, metrics.in_context(self._generate_batch), records,
+                        known_sources, existing, inserted_ids))
+
+        async def write():
+            inserted = 0
+            while True:
+                batch = await events_queue.get()
+                if batch is None:
+                    return inserted
+                inserted += self._write_batch(batch, existed_ids, update_time)
+
+        # One thread per blocking stage, so the batches go through each stage
+        # in order.
+        with ThreadPoolExecutor(max_workers=1) as reader, \
+                ThreadPoolExecutor(max_workers=1) as generator:
+            tasks = [asyncio.ensure_future(read(reader)),
+                    asyncio.ensure_future(generate(generator)),
+                    asyncio.ensure_future(write())]
+            try:
+                return (await asyncio.gather(*tasks))[2]
+            except BaseException:
+                # Do not leave the other stages waiting on a queue.
+                for task in tasks:
+                    task.cancel()
+                raise
+
+    def _new_update_time(self):
+        """ A whole-second timestamp later than any update_time of this type,
+        so the sweep is exact even for columns without fractional seconds. """
+        update_time = datetime.now(TZ).replace(microsecond=0)
+        last = self.session.query(func.max(Event.update_time))\
+                .filter(Event.type == self.get_event_type())\
+                .scalar()
+        if last is not None:
+            if last.tzinfo is None:
+                last = last.replace(tzinfo=TZ)
+            update_time = max(update_time, last.replace(microsecond=0) + timedelta(seconds=1))
+        return update_time
+
+    def _set_events_inactive(self, update_time):
+        """ Deactivate active events of this type not seen since update_time.
+        Return the number of deactivated events. """
+        conditions = (Event.type == self.get_event_type(), Event.is_active == True,
+                or_(Event.update_time == None, Event.update_time < update_time))
+        self._log_changes(ChangeKind.deactivated, update_time, *conditions)
+        result = self.session.execute(Event.__table__.update()
+                .where(and_(*conditions))
+                .values(is_active=False))
+        return result.rowcount
+
+    def _start_run(self, update_time):
+        """ Record a new run in import_run, committed at once so that
+        change_feed readers wait for it, and return its id. Runs of this
+        type still running after stale_run_timeout seconds are taken for
+        runs of importers that died and marked failed. """
+        stale_time = update_time - timedelta(seconds=self.stale_run_timeout)
+        self.session.execute(ImportRun.__table__.update()
+                .where(ImportRun.type == self.get_event_type())
+                .where(ImportRun.finish_time == None)
+                .where(ImportRun.start_time < stale_time)
+                .values(status='failed', finish_time=update_time))
+        result = self.session.execute(ImportRun.__table__.insert().values(
+                type=self.get_event_type(), status='running', start_time=update_time))
+        self.session.commit()
+        return result.inserted_primary_key[0]
 
-        for e in self.generate_events(source):
-            e.is_active = True
-            if e.is_valid():
-                self._insert_entry(e)
+    def _finish_run(self, status):
+        self.session.execute(ImportRun.__table__.update()
+                .where(ImportRun.id == self.run_id)
+                .values(status=status, finish_time=datetime.now(TZ)))
 
-        self.session.commit()
-        self.session.close()
+    def _fail_run(self):
+        """ Mark the current run failed, keeping the changes of the batches
+        it committed (with batched_commits). """
+        if self.run_id is None:
+            return
+        try:
+            self.session.rollback()
+            self._finish_run('failed')
+            self.session.commit()
+        except Exception:
+            logger.exception('Failed to mark import run %s failed', self.run_id)
+
+    def _log_changes(self, kind, change_time, *conditions):
+        """ Add a change of kind to event_change for every event matching
+        conditions, in one INSERT ... SELECT. """
+        columns = EventChange.__table__.c
+        select = self.session.query(literal(self.run_id, columns.run_id.type), Event.id,
+                literal(kind, columns.kind.type), literal(change_time, columns.change_time.type))\
+                .filter(*conditions)
+        self.session.execute(EventChange.__table__.insert().from_select(
+                ['run_id', 'event_id', 'kind', 'change_time'], select.statement))
+
+    def _load_source_keys(self):
+        """ Map the source key of every stored event of this type to its id. """
+        rows = self.session.query(Event.source_key, Event.id)\
+                .filter(Event.type == self.get_event_type())\
+                .filter(Event.source_key != None)
+        return dict(rows)
 
-    def _set_events_inactive(self):
-        for e in self.session.query(Event)\
+    def _load_existing_events(self):
+        """ Map the fingerprint of every stored event of this type to its id. """
+        rows = self.session.query(Event.fingerprint, Event.id)\
                 .filter(Event.type == self.get_event_type())\
-                .filter(Event.is_active == True):
-            e.is_active = False
-
-    def _insert_entry(self, e):
-        with self.session.no_autoflush:
-            existed = self.session.query(Event)\
-                    .filter(Event.gov_sn == e.gov_sn)\
-                    .filter(Event.type == e.type)\
-                    .filter(Event.city == e.city)\
-                    .filter(Event.district == e.district)\
-                    .filter(Event.detail_addr == e.detail_addr)\
-                    .filter(Event.start_date == e.start_date)\
-                    .filter(Event.end_date == e.end_date)\
-                    .filter(Event.start_time == e.start_time)\
-                    .filter(Event.end_time == e.end_time)\
-                    .filter(Event.description == e.description)\
-                    .first()
-            if existed:
-                existed.update_time = datetime.now(TZ)
-                existed.is_active = True
-            else:
-                e.update_time = e.create_time = datetime.now(TZ)
-                self.session.add(e)
+                .filter(Event.fingerprint != None)
+        return dict(rows)
+
+    def _insert_events(self, events, create_time):
+        event_rows = []
+        coordinate_rows = []
+        cell_rows = []
+        change_rows = []
+        for e in events:
+            # Leave out what failed to geocode.
+            coordinates = [(latitude, longitude) for latitude, longitude in e.coordinates
+                    if latitude is not None and longitude is not None]
+            row = e.to_row()
+            row['create_time'] = row['update_time'] = create_time
+            if coordinates:
+                row['geometry'] = map_converter.encode_polyline(coordinates)
+            if len(coordinates) > 1:
+                cell_rows.extend({'event_id': e.id, 'cell': cell}
+                        for cell in spatial.shape_cells(coordinates))
+            event_rows.append(row)
+            change_rows.append({'run_id': self.run_id, 'event_id': e.id,
+                'kind': ChangeKind.inserted, 'change_time': create_time})
+            if self.write_coordinates:
+                for latitude, longitude in coordinates:
+                    coordinate_rows.append({
+                        'id': get_uuid(),
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'event_id': e.id,
+                        'cell': spatial.grid_cell(latitude, longitude)})
+
+        if event_rows:
+            self.session.execute(Event.__table__.insert(), event_rows)
+        if coordinate_rows:
+            self.session.execute(Coordinate.__table__.insert(), coordinate_rows)
+        if cell_rows:
+            self.session.execute(EventCell.__table__.insert(), cell_rows)
+        if change_rows:
+            self.session.execute(EventChange.__table__.insert(), change_rows)
+
+    def _update_source_keys(self, source_keys):
+        """ Store the source key of existing events matched by fingerprint. """
+        statement = Event.__table__.update()\
+                .where(Event.id == bindparam('_id'))\
+                .values(source_key=bindparam('_source_key'))
+        updates = [{'_id': i, '_source_key': k} for i, k in source_keys.items()]
+        for i in range(0, len(updates), _BULK_CHUNK_SIZE):
+            self.session.execute(statement, updates[i:i + _BULK_CHUNK_SIZE])
+
+    def _reactivate_events(self, ids, update_time):
+        ids = list(ids)
+        for i in range(0, len(ids), _BULK_CHUNK_SIZE):
+            chunk = ids[i:i + _BULK_CHUNK_SIZE]
+            # Reactivating an event already active is not a change.
+            self._log_changes(ChangeKind.reactivated, update_time,
+                    Event.id.in_(chunk), Event.is_active == False)
+            self.session.execute(Event.__table__.update()
+                    .where(Event.id.in_(chunk))
+                    .values(is_active=True, update_time=update_time))
 
 
 class WaterImporter(DataImporter):
 
     _WATER_SOURCE = 'http://data.taipei/opendata/datalist/apiAccess?scope=resourceAquire&rid=a242ee9b-b954-4ae9-9827-2344c5dfeaea'
 
-    def __init__(self):
-        super().__init__()
+    # Douglas-Peucker tolerance, in metres, of the outage sections stored;
+    # 0 stores them verbatim.
+    simplify_tolerance = float(os.environ.get('LDB_SIMPLIFY_TOLERANCE', 1))
+
+    def __init__(self, connect=None):
+        super().__init__(connect)
 
     def get_event_type(self):
         return EventType.water
 
     def get_raw_data(self):
-        response = requests.get(self._WATER_SOURCE)
-        if response.status_code == 200:
-            print('Web (WATER OUTAGE) request is ok.')
-            return response.json()
-        else:
-            print('Web (WATER OUTAGE) request is NOT ok. Response status code = %s.'
-                % response.status_code)
-            return None
+        return self.fetch_json(self._WATER_SOURCE, 'WATER OUTAGE')
 
-    def generate_events(self, source):
-        for event_water in source['result']['results']:
-            timeinfo = datetime_parser.parse_water_road_time(event_water['Description'])
+    def get_records(self, source):
+        if self.stream:
+            return source
+        return source['result']['results']
+
+    def generate_events(self, records):
+        # Convert coordinate to address, concurrently for all records
+        first_coordinates = []
+        for event_water in records:
             coordinates = event_water['StopWaterSection_wgs84']['coordinates'][0]
+            first_coordinates.append((coordinates[0][1], coordinates[0][0]))
+        with self._stage('geocode'):
+            addresses = map_converter.convert_coordinates_to_addresses(first_coordinates)
 
-            # Convert coordinate to address
-            latitude = coordinates[0][1]
-            longitude = coordinates[0][0]
-            address = map_converter.convert_coordinate_to_address(latitude, longitude)
+        # Simplify the outage sections
+        with self._stage('simplify'):
+            shapes = [self._simplify(event_water['StopWaterSection_wgs84']['coordinates'][0])
+                    for event_water in records]
+
+        for event_water, address, coordinates in zip(records, addresses, shapes):
+            timeinfo = datetime_parser.parse_water_road_time(event_water['Description'])
 
             location_info = location_parser.parse_water_address(address)
             
             description_info = location_parser.parse_water_description(event_water['Description'])
 
-            event_model = Event(
+            event_model = EventRecord(
                 id=get_uuid(),
                 type=self.get_event_type(),
                 gov_sn=event_water['SW_No'],
+                source_key=self._located_source_key(event_water, location_info),
                 city=location_info[0],
                 district=location_info[1],
                 detail_addr=location_info[2],
@@ -129,50 +629,59 @@ class WaterImporter(DataImporter):
                 start_time=timeinfo[0],
                 end_time=timeinfo[1],
                 description=description_info,
+                coordinates=coordinates,
             )
-            for coor in coordinates:
-                event_model.coordinates.append(Coordinate(id=get_uuid(),
-                            wgs84_latitude=coor[1],
-                            wgs84_longitude=coor[0]))
+            event_model.fingerprint = event_fingerprint(event_model)
             yield event_model
 
+    def _simplify(self, ring):
+        """ The (latitude, longitude) pairs of a GeoJSON ring, simplified. """
+        coordinates = [(coor[1], coor[0]) for coor in ring]
+        simplified = map_converter.simplify_coordinates(coordinates, self.simplify_tolerance)
+        self._count('raw_vertices', len(coordinates))
+        self._count('simplified_vertices', len(simplified))
+        return simplified
+
 
 class RoadImporter(DataImporter):
 
     _ROAD_SOURCE = 'http://data.taipei/opendata/datalist/apiAccess?scope=resourceAquire&rid=201d8ae8-dffc-4d17-ae1f-e58d8a95b162'
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, connect=None):
+        super().__init__(connect)
 
     def get_event_type(self):
         return EventType.road
 
     def get_raw_data(self):
-        response = requests.get(self._ROAD_SOURCE)
-        if response.status_code == 200:
-            print('Web (ROAD CONSTRUCTION) request is ok.')
-            return response.json()
-        else:
-            print('Web (ROAD CONSTRUCTION) request is NOT ok. Response status code = %s.'
-                % response.status_code)
-            return None
+        return self.fetch_json(self._ROAD_SOURCE, 'ROAD CONSTRUCTION')
 
-    def generate_events(self, source):
-        for event in source['result']['results']:
-            timeinfo = datetime_parser.parse_water_road_time(event['CO_TI'])
+    def get_records(self, source):
+        if self.stream:
+            return source
+        return source['result']['results']
+
+    def generate_events(self, records):
+        # Convert TWD97 to WGS84, in one call for all records
+        latitudes, longitudes = map_converter.twd97_to_wgs84_batch(
+                [float(event['X']) for event in records],
+                [float(event['Y']) for event in records])
+        coordinates = [(float(lat), float(lng)) for lat, lng in zip(latitudes, longitudes)]
 
-            # Convert TWD97 to WGS84
-            latitude, longitude = map_converter.twd97_to_wgs84(float(event['X']), float(event['Y']))
+        # Convert coordinate to address, concurrently for all records
+        with self._stage('geocode'):
+            addresses = map_converter.convert_coordinates_to_addresses(coordinates)
 
-            # Convert coordinate to address
-            address = map_converter.convert_coordinate_to_address(latitude, longitude)
+        for event, (latitude, longitude), address in zip(records, coordinates, addresses):
+            timeinfo = datetime_parser.parse_water_road_time(event['CO_TI'])
 
             location_info = location_parser.parse_road_address(address)
 
-            event_model = Event(
+            event_model = EventRecord(
                 id=get_uuid(),
                 type=self.get_event_type(),
                 gov_sn='#'.join((event['AC_NO'], event['SNO'])),
+                source_key=self._located_source_key(event, location_info),
                 city=location_info[0],
                 district=location_info[1],
                 detail_addr=location_info[2],
@@ -181,10 +690,9 @@ class RoadImporter(DataImporter):
                 start_time=timeinfo[0],
                 end_time=timeinfo[1],
                 description=event['NPURP'],
+                coordinates=[(latitude, longitude)],
             )
-            event_model.coordinates.append(Coordinate(id=get_uuid(),
-                        wgs84_latitude=latitude,
-                        wgs84_longitude=longitude))
+            event_model.fingerprint = event_fingerprint(event_model)
             yield event_model
 
 
@@ -192,33 +700,76 @@ class PowerImporter(DataImporter):
 
     _POWER_SOURCE = 'http://branch.taipower.com.tw/Content/NoticeBlackout/bulletin.aspx?SiteID=564732646551216421&MmmID=616371300113254267'
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, connect=None, sources=None):
+        """ sources is a list of branch bulletin URLs, by default those in
+        LDB_POWER_SOURCES (whitespace separated) or the Taipei branch. """
+        super().__init__(connect)
+        self.sources = sources or os.environ.get('LDB_POWER_SOURCES', '').split() \
+                or [self._POWER_SOURCE]
 
     def get_event_type(self):
         return EventType.power
 
     def get_raw_data(self):
-        response = requests.get(self._POWER_SOURCE)
-        if response.status_code == 200:
-            print('Web (POWER OUTAGE) request is ok.')
-            
-            info = power_web_parser.get_html_info(response)
-            return info
-        else:
-            print('Web (POWER OUTAGE) request is NOT ok. Response status code = %s.' % response.status_code)
+        """ Fetch the bulletins of every branch concurrently and parse them in
+        a process pool. All branches are imported together, so either all
+        of them are fetched or the import is skipped. """
+        states = [self._get_source_state(url) for url in self.sources]
+        fetched = self._fetch_concurrently(self.sources, states)
+        if any(response is None for response, _ in fetched):
             return None
-
-    def generate_events(self, source):
-        # arrange data and insert to table
-        for event in source:
+        if all(response is fetcher.UNCHANGED for response, _ in fetched):
+            return fetcher.UNCHANGED
+
+        # Branches unchanged since the last import are fetched again in full.
+        unchanged = [i for i, (response, _) in enumerate(fetched) if response is fetcher.UNCHANGED]
+        if unchanged:
+            refetched = self._fetch_concurrently([self.sources[i] for i in unchanged],
+                    [None] * len(unchanged))
+            for i, f in zip(unchanged, refetched):
+                fetched[i] = f
+            if any(response is None for response, _ in fetched):
+                return None
+
+        self._source_states.extend(state for _, state in fetched)
+        texts = [response.text for response, _ in fetched]
+        with self._stage('parse'):
+            if len(texts) > 1:
+                # Spawned, not forked: a fork could copy a lock (of logging or
+                # metrics) held by another importer's thread.
+                with ProcessPoolExecutor(max_workers=min(len(texts), os.cpu_count() or 1),
+                        mp_context=multiprocessing.get_context('spawn')) as executor:
+                    pages = list(executor.map(_parse_power_page, texts))
+                # Carry the counters of the worker processes over to this one.
+                for _, counters in pages:
+                    for name, n in counters.items():
+                        metrics.increment(name, n)
+                pages = [records for records, _ in pages]
+            else:
+                pages = [power_web_parser.parse_html_records(texts[0])]
+        return [record for page in pages for record in page]
+
+    def _fetch_concurrently(self, urls, states):
+        """ fetcher.fetch every URL of urls with the SourceState at the same
+        index of states. Return the results in the order of urls. """
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            return list(executor.map(
+                lambda url, state: fetcher.fetch(url, 'POWER OUTAGE', state), urls, states))
+
+    def generate_events(self, records):
+        # geocode records, arrange data and insert to table
+        with self._stage('geocode'):
+            events = power_web_parser.geocode_html_records(records)
+        for record, event in zip(records, events):
             
             (date_info, start_time_info, end_time_info, sn_info, description_info, location_info, latitude, longitude) = event
             
-            event_model = Event(
+            event_model = EventRecord(
                 id=get_uuid(),
                 type=self.get_event_type(),
                 gov_sn=sn_info,
+                source_key=self._located_source_key(record, location_info,
+                        [(latitude, longitude)]),
                 city=location_info[0],
                 district=location_info[1],
                 detail_addr=location_info[2],
@@ -227,18 +778,74 @@ class PowerImporter(DataImporter):
                 start_time=start_time_info,
                 end_time=end_time_info,
                 description=description_info,
+                coordinates=[(latitude, longitude)],
             )
-            event_model.coordinates.append(Coordinate(id=get_uuid(),
-                wgs84_latitude=latitude,
-                wgs84_longitude=longitude))
+            event_model.fingerprint = event_fingerprint(event_model)
             yield event_model
 
 
+def _parse_power_page(text):
+    """ power_web_parser.parse_html_records in a worker process, also
+    returning the metrics counters it incremented. """
+    before = metrics.snapshot()
+    return (power_web_parser.parse_html_records(text), metrics.counters_since(before))
+
+
 ### Import all types of livelihood data ###
-def import_all():
-    WaterImporter().import_data()
-    RoadImporter().import_data()
-    PowerImporter().import_data()
+ImportResult = namedtuple('ImportResult', ['name', 'ok', 'summary', 'error', 'elapsed', 'metrics'])
+
+_IMPORTERS = (WaterImporter, RoadImporter, PowerImporter)
+
+def import_all(parallel=None):
+    """ Run every importer and return a list of ImportResult, one per importer,
+    with the metrics.ImportMetrics of its run.
+
+    parallel is None to run the importers one after another, 'thread' to run
+    them concurrently in threads sharing one DB engine, or 'process' to run
+    them in separate processes, each with its own engine. A failing importer
+    does not stop the others; its ImportResult has ok=False and the error.
+
+    The processes are spawned rather than forked, so that none of them
+    inherits the geocode cache's SQLite connection or the HTTP sessions, and
+    they share the LDB_GEOCODE_QPS quota, each getting an equal part of it.
+    Like any spawned process, they import the caller's main module, whose
+    entry point must then be guarded by if __name__ == '__main__'.
+    """
+    if parallel is None:
+        connect = DBConnector(LDB_URL)
+        return [_run_importer(cls, connect) for cls in _IMPORTERS]
+    elif parallel == 'thread':
+        connect = DBConnector(LDB_URL)
+        with ThreadPoolExecutor(max_workers=len(_IMPORTERS)) as executor:
+            futures = [executor.submit(_run_importer, cls, connect) for cls in _IMPORTERS]
+    elif parallel == 'process':
+        with ProcessPoolExecutor(max_workers=len(_IMPORTERS),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_importer_process,
+                initargs=(map_converter.rate_limiter.rate / len(_IMPORTERS),)) as executor:
+            futures = [executor.submit(_run_importer, cls) for cls in _IMPORTERS]
+    else:
+        raise ValueError('Unknown parallel mode: %s' % parallel)
+    return [f.result() for f in futures]
+
+def _init_importer_process(geocode_qps):
+    """ Give an importer process its part of the geocode quota. """
+    map_converter.set_rate_limiter(RateLimiter(geocode_qps))
+
+def _run_importer(importer_class, connect=None):
+    start = time.time()
+    importer = None
+    try:
+        importer = importer_class(connect)
+        summary = importer.import_data()
+        return ImportResult(importer_class.__name__, True, summary, None,
+                time.time() - start, importer.metrics)
+    except Exception as e:
+        if importer is not None:
+            importer.session.close()
+        logger.exception('%s failed', importer_class.__name__)
+        return ImportResult(importer_class.__name__, False, None, repr(e), time.time() - start,
+                importer.metrics if importer is not None else None)
 
 
 ### Create livelihood database ###
@@ -247,7 +854,38 @@ def create_tables():
     connect.create_tables()
 
 
+### Add missing indexes to an existing livelihood database ###
+def ensure_indexes():
+    connect = DBConnector(LDB_URL)
+    connect.ensure_indexes()
+
+
+### Upgrade livelihood database created by an older version ###
+def upgrade_tables():
+    connect = DBConnector(LDB_URL)
+    connect.upgrade_tables()
+
+
 def get_uuid():
     return str(uuid.uuid4())
 
 
+def _event_loop_running():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
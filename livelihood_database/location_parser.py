@@ -1,29 +1,37 @@
 # coding=utf-8
 
+import logging
 import re
 
-_ADDRESS_REGEX = '(?:\d*)?(?:台灣)?((?:.*?市)?)((?:.*?區)?)((?:.*?(?:路|街|大道|橋))?(?:[一二三四五六七八九十\d]*?段)?(?:\d*?巷)?(?:\d*?弄)?(?:[-\d]*?號)?)(?:.*)'
+from . import address_normalizer
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_ADDRESS_REGEX = address_normalizer.ADDRESS_REGEX
 _DESCRIPTION_REGEX = '(進行.*?工程)'
 
-address_pattern = re.compile(_ADDRESS_REGEX)
+address_pattern = address_normalizer.address_pattern
 description_pattern = re.compile(_DESCRIPTION_REGEX)
 
 """ Address of ROAD CONSTRUCTION """
 def parse_road_address(address_name):
-    sub_address = address_pattern.search(address_name)
+    sub_address = address_normalizer.parse_address(address_name)
     if sub_address:
-        return sub_address.groups()
+        return sub_address
     else:
-        print('Unable to parse address: ' + address_name)
+        metrics.increment('location_parse_failures')
+        logger.debug('Unable to parse address: %s', address_name)
         return (None, None, None)
 
 """ Address of WATER OUTAGE """
 def parse_water_address(address_name):
-    sub_address = address_pattern.search(address_name)
+    sub_address = address_normalizer.parse_address(address_name)
     if sub_address:
-        return sub_address.groups()
+        return sub_address
     else:
-        print('Unable to parse address: ' + address_name)
+        metrics.increment('location_parse_failures')
+        logger.debug('Unable to parse address: %s', address_name)
         return (None, None, None)
 
 def parse_water_description(description):
@@ -31,7 +39,8 @@ def parse_water_description(description):
     if sub_description:
         return sub_description.group(1)
     else:
-        print('Unable to parse description: ' + description)
+        metrics.increment('location_parse_failures')
+        logger.debug('Unable to parse description: %s', description)
         return None
 
 
@@ -1,17 +1,73 @@
 # coding=utf-8
 
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import os
 import urllib.parse
 import requests
 import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import metrics
+from .geocode_cache import GeocodeCache
+# Compact encoding of coordinates, as stored in Event.geometry.
+from .polyline import encode_polyline, decode_polyline
+from .rate_limiter import RateLimiter
+from .reverse_geocoder import ReverseGeocoder
+
+logger = logging.getLogger(__name__)
 
 KEY = os.environ['GOOGLE_GEO_KEY']
+GEOCODE_URL = os.environ.get('GOOGLE_GEO_URL', 'https://maps.googleapis.com/maps/api/geocode/json')
+GEOCODE_WORKERS = int(os.environ.get('LDB_GEOCODE_WORKERS', 8))
+
+# Shared by every geocode request, including the concurrent batch helpers:
+# keeps connections alive and holds the request rate under the API quota.
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=GEOCODE_WORKERS))
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=GEOCODE_WORKERS))
+rate_limiter = RateLimiter(float(os.environ.get('LDB_GEOCODE_QPS', 50)))
+
+def set_rate_limiter(limiter):
+    global rate_limiter
+    rate_limiter = limiter
+
+# Geocode results are cached in-process and, if LDB_GEOCODE_CACHE names a
+# SQLite file, persisted across runs. Use set_cache() to plug in another cache.
+cache = GeocodeCache.from_environ()
+
+def set_cache(geocode_cache):
+    global cache
+    cache = geocode_cache
+
+# Answers convert_coordinate_to_address from local files when
+# LDB_REVERSE_GEOCODE_BOUNDARIES and LDB_REVERSE_GEOCODE_ADDRESSES are set,
+# falling back to Google when the local answer is ambiguous. Use
+# set_reverse_geocoder() to plug in another one, or None to turn it off.
+reverse_geocoder = ReverseGeocoder.from_environ()
+
+def set_reverse_geocoder(geocoder):
+    global reverse_geocoder
+    reverse_geocoder = geocoder
 
 def convert_address_to_coordinate(address_name):
 
-    url_address = 'https://maps.googleapis.com/maps/api/geocode/json?address=' + urllib.parse.quote(address_name) + '&sensor=false&language=zh-tw&key=' + KEY
+    cache_key = cache.address_key(address_name)
+    hit, cached = cache.lookup(cache_key)
+    if hit:
+        metrics.increment('geocode_cache_hits')
+        if cached is None:
+            return ((None, None), '')
+        return (tuple(cached[0]), cached[1])
+
+    url_address = GEOCODE_URL + '?address=' + urllib.parse.quote(address_name) + '&sensor=false&language=zh-tw&key=' + KEY
 
-    web_request_coordinate = requests.get(url_address)
+    rate_limiter.acquire()
+    metrics.increment('geocode_requests')
+    web_request_coordinate = session.get(url_address)
 
     if web_request_coordinate.status_code == 200:            
         json_coordinate = web_request_coordinate.json()
@@ -20,73 +76,215 @@ def convert_address_to_coordinate(address_name):
             latitude = json_coordinate['results'][0]['geometry']['location']['lat']
             longitude = json_coordinate['results'][0]['geometry']['location']['lng']
             formatted_address = json_coordinate['results'][0]['formatted_address']
+            cache.store(cache_key, [[latitude, longitude], formatted_address])
             return ((latitude, longitude), formatted_address)
         else:
-            print('Status: ' + json_coordinate['status'] + ', ' + 'unexpected address: ' + address_name)
+            if json_coordinate['status'] == 'ZERO_RESULTS':
+                cache.store(cache_key, None)
+            metrics.increment('geocode_failures')
+            logger.debug('Status: %s, unexpected address: %s', json_coordinate['status'], address_name)
             return ((None, None), '')
 
     else:
-        print('Web (ADDRESS TO COORDINATE) request is NOT ok. Request status code = %s.' % web_request_coordinate.status_code)
+        metrics.increment('geocode_failures')
+        logger.warning('Web (ADDRESS TO COORDINATE) request is NOT ok. Request status code = %s.',
+            web_request_coordinate.status_code)
         return ((None, None), '')
 
 def convert_coordinate_to_address(latitude, longitude):
 
-    url_coordinate = 'https://maps.googleapis.com/maps/api/geocode/json?latlng=' + str(latitude) + ',' + str(longitude) + '&sensor=false&language=zh-tw&key=' + KEY
+    if reverse_geocoder is not None:
+        local_address = reverse_geocoder.reverse(latitude, longitude)
+        if local_address is not None:
+            metrics.increment('geocode_local_hits')
+            return local_address
+        metrics.increment('geocode_local_misses')
 
-    web_request_address = requests.get(url_coordinate)
+    cache_key = cache.coordinate_key(latitude, longitude)
+    hit, cached = cache.lookup(cache_key)
+    if hit:
+        metrics.increment('geocode_cache_hits')
+        return cached if cached is not None else ''
+
+    url_coordinate = GEOCODE_URL + '?latlng=' + str(latitude) + ',' + str(longitude) + '&sensor=false&language=zh-tw&key=' + KEY
+
+    rate_limiter.acquire()
+    metrics.increment('geocode_requests')
+    web_request_address = session.get(url_coordinate)
 
     if web_request_address.status_code == 200:
         json_address = web_request_address.json()
         
         if json_address['status'] == 'OK':
-            return json_address['results'][0]['formatted_address']
+            formatted_address = json_address['results'][0]['formatted_address']
+            cache.store(cache_key, formatted_address)
+            return formatted_address
         else:
-            print('Unexpected coordinate: (%s, %s)' % (str(latitude), str(longitude)))
+            if json_address['status'] == 'ZERO_RESULTS':
+                cache.store(cache_key, None)
+            metrics.increment('geocode_failures')
+            logger.debug('Unexpected coordinate: (%s, %s)', latitude, longitude)
             return ''
     
     else:
-        print('Web (COORDINATE TO ADDRESS) request is NOT ok. Request status code = %s.'
-            % web_request_address.status_code)
+        metrics.increment('geocode_failures')
+        logger.warning('Web (COORDINATE TO ADDRESS) request is NOT ok. Request status code = %s.',
+            web_request_address.status_code)
         return ''
 
+""" Batch geocoding: results are returned in the order of the input. """
+def convert_addresses_to_coordinates(address_names, workers=None):
+    return _map_concurrently(convert_address_to_coordinate, address_names, workers)
+
+def convert_coordinates_to_addresses(coordinates, workers=None):
+    return _map_concurrently(lambda c: convert_coordinate_to_address(c[0], c[1]),
+            coordinates, workers)
+
+def _map_concurrently(func, items, workers):
+    items = list(items)
+    unique_items = list(dict.fromkeys(items))
+    workers = min(workers or GEOCODE_WORKERS, len(unique_items))
+    if workers <= 1:
+        results = [func(i) for i in unique_items]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(metrics.in_context(func), unique_items))
+    results = dict(zip(unique_items, results))
+    return [results[i] for i in items]
+
+""" TWD97 (TM2, central meridian 121E) <-> WGS84 on the GRS80 ellipsoid. The
+batch functions take sequences or arrays and are vectorized when numpy is
+installed. """
 def twd97_to_wgs84(x, y):
-    a = 6378137.0
-    b = 6356752.314245
-    longitude_origin = 121 * math.pi / 180
-    k0 = 0.9999
-    dx = 250000
-
-    dy = 0
-    e = math.pow((1 - math.pow(b, 2) / math.pow(a, 2)), 0.5)
-    x -= dx
-    y -= dy
-    M = y / k0
-    mu = M / (a * (1.0 - math.pow(e, 2) / 4.0 - 3 * math.pow(e, 4) / 64.0 - 5 * math.pow(e, 6) / 256.0))
-    e1 = (1.0 - math.pow((1.0 - math.pow(e, 2)), 0.5)) / (1.0 + math.pow((1.0 - math.pow(e, 2)), 0.5))
-    J1 = (3 * e1 / 2 - 27 * math.pow(e1, 3) / 32.0)
-    J2 = (21 * math.pow(e1, 2) / 16 - 55 * math.pow(e1, 4) / 32.0)
-    J3 = (151 * math.pow(e1, 3) / 96.0)
-    J4 = (1097 * math.pow(e1, 4) / 512.0)
-    fp = mu + J1 * math.sin(2 * mu) + J2 * math.sin(4 * mu) + J3 * math.sin(6 * mu) + J4 * math.sin(8 * mu)
-    e2 = math.pow((e * a / b), 2)
-    C1 = math.pow(e2 * math.cos(fp), 2)
-    T1 = math.pow(math.tan(fp), 2)
-    R1 = a * (1 - math.pow(e, 2)) / math.pow((1 - math.pow(e, 2) * math.pow(math.sin(fp), 2)), (3.0 / 2.0))
-    N1 = a / math.pow((1 - math.pow(e, 2) * math.pow(math.sin(fp), 2)), 0.5)
-
-    D = x / (N1 * k0)
-    Q1 = N1 * math.tan(fp) / R1
-    Q2 = (math.pow(D, 2) / 2.0)
-    Q3 = (5 + 3 * T1 + 10 * C1 - 4 * math.pow(C1, 2) - 9 * e2) * math.pow(D, 4) / 24.0
-    Q4 = (61 + 90 * T1 + 298 * C1 + 45 * math.pow(T1, 2) - 3 * math.pow(C1, 2) - 252 * e2) * math.pow(D, 6) / 720.0
+    return _twd97_to_wgs84(x, y, math)
+
+def wgs84_to_twd97(latitude, longitude):
+    return _wgs84_to_twd97(latitude, longitude, math)
+
+def twd97_to_wgs84_batch(xs, ys):
+    """ Return (latitudes, longitudes). """
+    if numpy is not None:
+        return _twd97_to_wgs84(numpy.asarray(xs, dtype=float), numpy.asarray(ys, dtype=float), numpy)
+    points = [twd97_to_wgs84(x, y) for x, y in zip(xs, ys)]
+    return ([p[0] for p in points], [p[1] for p in points])
+
+def wgs84_to_twd97_batch(latitudes, longitudes):
+    """ Return (xs, ys). """
+    if numpy is not None:
+        return _wgs84_to_twd97(numpy.asarray(latitudes, dtype=float), numpy.asarray(longitudes, dtype=float), numpy)
+    points = [wgs84_to_twd97(lat, lng) for lat, lng in zip(latitudes, longitudes)]
+    return ([p[0] for p in points], [p[1] for p in points])
+
+def simplify_coordinates(coordinates, tolerance):
+    """ Douglas-Peucker simplification of a line or closed ring of
+    (latitude, longitude) pairs: drop the vertices within tolerance metres,
+    measured in TWD97, of the simplified shape. The kept vertices are
+    returned unchanged. A ring that would collapse to fewer than 4 vertices
+    is returned whole. """
+    coordinates = list(coordinates)
+    if not tolerance or len(coordinates) < 3:
+        return coordinates
+    xs, ys = wgs84_to_twd97_batch([c[0] for c in coordinates], [c[1] for c in coordinates])
+    if numpy is not None:
+        xs, ys = xs.tolist(), ys.tolist()
+    kept = [coordinates[i] for i in _douglas_peucker(xs, ys, tolerance)]
+    if coordinates[0] == coordinates[-1] and len(kept) < 4:
+        return coordinates
+    return kept
+
+def _douglas_peucker(xs, ys, tolerance):
+    """ Indexes of the vertices kept, in order. """
+    last = len(xs) - 1
+    keep = [False] * len(xs)
+    keep[0] = keep[last] = True
+    tolerance2 = tolerance * tolerance
+    stack = [(0, last)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = xs[first], ys[first]
+        dx, dy = xs[last] - x1, ys[last] - y1
+        length2 = dx * dx + dy * dy
+        farthest, farthest_distance2 = None, tolerance2
+        for i in range(first + 1, last):
+            px, py = xs[i] - x1, ys[i] - y1
+            # Squared distance to the segment from first to last.
+            t = (px * dx + py * dy) / length2 if length2 else 0
+            if t < 0:
+                t = 0
+            elif t > 1:
+                t = 1
+            ex, ey = px - t * dx, py - t * dy
+            distance2 = ex * ex + ey * ey
+            if distance2 > farthest_distance2:
+                farthest, farthest_distance2 = i, distance2
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [i for i, k in enumerate(keep) if k]
+
+_A = 6378137.0
+_B = 6356752.314245
+_LONGITUDE_ORIGIN = 121 * math.pi / 180
+_K0 = 0.9999
+_DX = 250000
+_DY = 0
+_E = math.pow((1 - math.pow(_B, 2) / math.pow(_A, 2)), 0.5)
+_EE = math.pow(_E, 2)
+_E1 = (1.0 - math.pow((1.0 - _EE), 0.5)) / (1.0 + math.pow((1.0 - _EE), 0.5))
+_J1 = (3 * _E1 / 2 - 27 * math.pow(_E1, 3) / 32.0)
+_J2 = (21 * math.pow(_E1, 2) / 16 - 55 * math.pow(_E1, 4) / 32.0)
+_J3 = (151 * math.pow(_E1, 3) / 96.0)
+_J4 = (1097 * math.pow(_E1, 4) / 512.0)
+_E2 = math.pow((_E * _A / _B), 2)
+_MU_DIVISOR = _A * (1.0 - _EE / 4.0 - 3 * math.pow(_E, 4) / 64.0 - 5 * math.pow(_E, 6) / 256.0)
+_M1 = 1 - _EE / 4 - 3 * math.pow(_E, 4) / 64 - 5 * math.pow(_E, 6) / 256
+_M2 = 3 * _EE / 8 + 3 * math.pow(_E, 4) / 32 + 45 * math.pow(_E, 6) / 1024
+_M3 = 15 * math.pow(_E, 4) / 256 + 45 * math.pow(_E, 6) / 1024
+_M4 = 35 * math.pow(_E, 6) / 3072
+
+def _twd97_to_wgs84(x, y, xp):
+    x = x - _DX
+    y = y - _DY
+    M = y / _K0
+    mu = M / _MU_DIVISOR
+    fp = mu + _J1 * xp.sin(2 * mu) + _J2 * xp.sin(4 * mu) + _J3 * xp.sin(6 * mu) + _J4 * xp.sin(8 * mu)
+    C1 = (_E2 * xp.cos(fp)) ** 2
+    T1 = xp.tan(fp) ** 2
+    sin_fp2 = xp.sin(fp) ** 2
+    R1 = _A * (1 - _EE) / (1 - _EE * sin_fp2) ** 1.5
+    N1 = _A / (1 - _EE * sin_fp2) ** 0.5
+
+    D = x / (N1 * _K0)
+    Q1 = N1 * xp.tan(fp) / R1
+    Q2 = D ** 2 / 2.0
+    Q3 = (5 + 3 * T1 + 10 * C1 - 4 * C1 ** 2 - 9 * _E2) * D ** 4 / 24.0
+    Q4 = (61 + 90 * T1 + 298 * C1 + 45 * T1 ** 2 - 3 * C1 ** 2 - 252 * _E2) * D ** 6 / 720.0
     latitude = fp - Q1 * (Q2 - Q3 + Q4)
     Q5 = D
-    Q6 = (1 + 2 * T1 + C1) * math.pow(D, 3) / 6
-    Q7 = (5 - 2 * C1 + 28 * T1 - 3 * math.pow(C1, 2) + 8 * e2 + 24 * math.pow(T1, 2)) * math.pow(D, 5) / 120.0
-    longitude = longitude_origin + (Q5 - Q6 + Q7) / math.cos(fp)
+    Q6 = (1 + 2 * T1 + C1) * D ** 3 / 6
+    Q7 = (5 - 2 * C1 + 28 * T1 - 3 * C1 ** 2 + 8 * _E2 + 24 * T1 ** 2) * D ** 5 / 120.0
+    longitude = _LONGITUDE_ORIGIN + (Q5 - Q6 + Q7) / xp.cos(fp)
     latitude = (latitude * 180) / math.pi
     longitude = (longitude * 180) / math.pi
 
     return (latitude, longitude)
 
+def _wgs84_to_twd97(latitude, longitude, xp):
+    lat = latitude * math.pi / 180
+    lng = longitude * math.pi / 180
+    sin_lat = xp.sin(lat)
+    cos_lat = xp.cos(lat)
+    N = _A / (1 - _EE * sin_lat ** 2) ** 0.5
+    T = xp.tan(lat) ** 2
+    C = _E2 * cos_lat ** 2
+    A = (lng - _LONGITUDE_ORIGIN) * cos_lat
+    M = _A * (_M1 * lat - _M2 * xp.sin(2 * lat) + _M3 * xp.sin(4 * lat) - _M4 * xp.sin(6 * lat))
+
+    x = _DX + _K0 * N * (A + (1 - T + C) * A ** 3 / 6
+            + (5 - 18 * T + T ** 2 + 72 * C - 58 * _E2) * A ** 5 / 120)
+    y = _DY + _K0 * (M + N * xp.tan(lat) * (A ** 2 / 2
+            + (5 - T + 9 * C + 4 * C ** 2) * A ** 4 / 24
+            + (61 - 58 * T + T ** 2 + 600 * C - 330 * _E2) * A ** 6 / 720))
 
+    return (x, y)
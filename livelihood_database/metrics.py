@@ -0,0 +1,198 @@
+# coding=utf-8
+
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Process-wide totals of the counters incremented by the parsers and
+# map_converter, e.g. geocode_requests or location_parse_failures.
+_counters = collections.Counter()
+_counters_lock = threading.Lock()
+
+# ImportMetrics of the run the current context works for, which gets the
+# increments too. Threads working for a run must be started in a copy of
+# its context (see in_context).
+_run_metrics = contextvars.ContextVar('run_metrics', default=None)
+
+
+def increment(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+    run_metrics = _run_metrics.get()
+    if run_metrics is not None:
+        run_metrics.count(name, n)
+
+
+@contextlib.contextmanager
+def counting(run_metrics):
+    """ Add the increments made in the with block, and in the threads it
+    starts with in_context, to the counts of run_metrics. """
+    token = _run_metrics.set(run_metrics)
+    try:
+        yield
+    finally:
+        _run_metrics.reset(token)
+
+
+def in_context(func):
+    """ func wrapped to run in a copy of the current context, e.g. to submit
+    it to a thread pool from within counting(). """
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(func, *args)
+
+
+def snapshot():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def counters_since(before):
+    """ The growth of the process-wide counters since snapshot() returned
+    before. """
+    after = snapshot()
+    return {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)}
+
+
+class ImportMetrics(object):
+    """ Wall time per stage and counts of one import_data run.
+
+    status is 'ok', 'unchanged', 'skipped' (the source could not be
+    fetched) or 'failed'.
+    """
+
+    def __init__(self, event_type):
+        self.event_type = event_type
+        self.start_time = time.time()
+        self.elapsed = None
+        self.status = None
+        self.stages = collections.OrderedDict()
+        self.counts = collections.Counter()
+        # Counted from the threads of the run.
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Returned by the processes of import_all; the lock does not pickle.
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def finish(self, status):
+        self.status = status
+        self.elapsed = time.time() - self.start_time
+
+    def to_dict(self):
+        return {
+            'type': self.event_type,
+            'status': self.status,
+            'start_time': self.start_time,
+            'elapsed': self.elapsed,
+            'stages': dict(self.stages),
+            'counts': dict(self.counts),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def to_prometheus(self):
+        """ The metrics in the Prometheus text exposition format. """
+        label = 'type="%s"' % self.event_type
+        lines = [
+            '# HELP livelihood_import_success Whether the last import succeeded.',
+            '# TYPE livelihood_import_success gauge',
+            'livelihood_import_success{%s} %d' % (label, self.status != 'failed'),
+            '# HELP livelihood_import_last_run_timestamp_seconds Start time of the last import.',
+            '# TYPE livelihood_import_last_run_timestamp_seconds gauge',
+            'livelihood_import_last_run_timestamp_seconds{%s} %.3f' % (label, self.start_time),
+            '# HELP livelihood_import_duration_seconds Wall time of the last import.',
+            '# TYPE livelihood_import_duration_seconds gauge',
+            'livelihood_import_duration_seconds{%s} %.6f' % (label, self.elapsed or 0),
+            '# HELP livelihood_import_stage_seconds Wall time per stage of the last import.',
+            '# TYPE livelihood_import_stage_seconds gauge',
+        ]
+        for stage, seconds in self.stages.items():
+            lines.append('livelihood_import_stage_seconds{%s,stage="%s"} %.6f' % (label, stage, seconds))
+        lines += [
+            '# HELP livelihood_import_count Counts of the last import.',
+            '# TYPE livelihood_import_count gauge',
+        ]
+        for name, n in sorted(self.counts.items()):
+            lines.append('livelihood_import_count{%s,name="%s"} %d' % (label, name, n))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """ Replace the file at path with to_prometheus(), atomically as the
+        node_exporter textfile collector requires. """
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.write(self.to_prometheus())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+class ImportListener(object):
+    """ Receives the progress of import_data runs. Register listeners in
+    DataImporter.listeners; override the methods of interest. """
+
+    def stage_finished(self, importer, stage, seconds):
+        pass
+
+    def import_finished(self, importer, metrics):
+        """ Called once per run, after the commit of a successful import and
+        also for unchanged, skipped or failed runs. """
+        pass
+
+
+class JsonLogListener(ImportListener):
+    """ Log the metrics of every run as one JSON line. """
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def import_finished(self, importer, metrics):
+        self.logger.log(self.level, metrics.to_json())
+
+
+class PrometheusFileListener(ImportListener):
+    """ Write the metrics of every run to livelihood_<type>.prom in
+    directory, e.g. the node_exporter textfile collector directory. """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def import_finished(self, importer, metrics):
+        metrics.write_prometheus(os.path.join(self.directory,
+                'livelihood_%s.prom' % metrics.event_type))
+
+
+def default_listeners():
+    """ A JsonLogListener, and a PrometheusFileListener if LDB_METRICS_DIR
+    names a directory. """
+    listeners = [JsonLogListener()]
+    directory = os.environ.get('LDB_METRICS_DIR')
+    if directory:
+        listeners.append(PrometheusFileListener(directory))
+    return listeners
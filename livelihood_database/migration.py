@@ -0,0 +1,154 @@
+# coding=utf-8
+
+import logging
+
+from sqlalchemy import bindparam
+from sqlalchemy import inspect
+from sqlalchemy import text
+
+from . import dbschema
+from . import polyline
+from . import spatial
+from .dbschema import Coordinate, Event, EventCell
+
+logger = logging.getLogger(__name__)
+
+_BACKFILL_BATCH_SIZE = 1000
+# Events per query of backfill_geometry, below SQLite's variable limit.
+_GEOMETRY_BATCH_SIZE = 500
+# Coordinate rows per query of backfill_cells.
+_CELL_BATCH_SIZE = 10000
+
+
+def add_missing_columns(engine):
+    """ ALTER existing tables to add columns defined in dbschema but missing
+    from the database. New columns must be nullable. """
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as conn:
+        for table in dbschema.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = set(c['name'] for c in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    logger.info('Add column %s.%s', table.name, column.name)
+                    conn.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                        table.name, column.name, column.type.compile(dialect=engine.dialect))))
+
+
+def create_missing_indexes(engine):
+    """ Create indexes defined in dbschema but missing from the database.
+    Indexes on columns the database does not have yet are skipped; run
+    add_missing_columns (or DBConnector.upgrade_tables) first. """
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in dbschema.Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+        existing_columns = set(c['name'] for c in inspector.get_columns(table.name))
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            missing = [c.name for c in index.columns if c.name not in existing_columns]
+            if missing:
+                logger.warning('Skip index %s: column %s.%s is missing, upgrade the tables first',
+                        index.name, table.name, missing[0])
+                continue
+            logger.info('Create index %s', index.name)
+            index.create(engine)
+
+
+def backfill_fingerprints(session):
+    """ Fill Event.fingerprint for rows stored before the column existed.
+    Rows duplicating an already fingerprinted event are left NULL. """
+    known = set(f for (f,) in session.query(Event.fingerprint)
+            .filter(Event.fingerprint != None))
+    columns = [getattr(Event, name) for name in Event._FINGERPRINT_FIELDS]
+
+    updates = []
+    for row in session.query(Event.id, *columns).filter(Event.fingerprint == None):
+        fingerprint = dbschema.event_fingerprint(row)
+        if fingerprint in known:
+            logger.warning('Duplicate event %s is left without fingerprint', row.id)
+            continue
+        known.add(fingerprint)
+        updates.append({'_id': row.id, '_fingerprint': fingerprint})
+
+    statement = Event.__table__.update()\
+            .where(Event.id == bindparam('_id'))\
+            .values(fingerprint=bindparam('_fingerprint'))
+    for i in range(0, len(updates), _BACKFILL_BATCH_SIZE):
+        session.execute(statement, updates[i:i + _BACKFILL_BATCH_SIZE])
+    session.commit()
+    return len(updates)
+
+
+def backfill_geometry(session):
+    """ Fill Event.geometry from the coordinate rows of events stored before
+    the column existed. The coordinate table has no vertex order, so the
+    vertices are taken in the order the database returns them: insertion
+    order on SQLite, but not necessarily on other databases. """
+    ids = [i for (i,) in session.query(Event.id).filter(Event.geometry == None)]
+    statement = Event.__table__.update()\
+            .where(Event.id == bindparam('_id'))\
+            .values(geometry=bindparam('_geometry'))
+    filled = 0
+    for i in range(0, len(ids), _GEOMETRY_BATCH_SIZE):
+        coordinates = {}
+        rows = session.query(Coordinate.event_id, Coordinate.wgs84_latitude, Coordinate.wgs84_longitude)\
+                .filter(Coordinate.event_id.in_(ids[i:i + _GEOMETRY_BATCH_SIZE]))
+        for event_id, latitude, longitude in rows:
+            coordinates.setdefault(event_id, []).append((latitude, longitude))
+        updates = [{'_id': event_id, '_geometry': polyline.encode_polyline(vertices)}
+                for event_id, vertices in coordinates.items()]
+        if updates:
+            session.execute(statement, updates)
+        filled += len(updates)
+    session.commit()
+    return filled
+
+
+def backfill_cells(session):
+    """ Fill Coordinate.cell for rows stored before the column existed. The
+    rows are read and updated a batch at a time, so memory stays bounded by
+    a batch however many rows are stored. """
+    statement = Coordinate.__table__.update()\
+            .where(Coordinate.id == bindparam('_id'))\
+            .values(cell=bindparam('_cell'))
+    filled = 0
+    while True:
+        rows = session.query(Coordinate.id, Coordinate.wgs84_latitude, Coordinate.wgs84_longitude)\
+                .filter(Coordinate.cell == None)\
+                .limit(_CELL_BATCH_SIZE)\
+                .all()
+        if not rows:
+            break
+        session.execute(statement, [{'_id': i, '_cell': spatial.grid_cell(latitude, longitude)}
+                for i, latitude, longitude in rows])
+        session.commit()
+        filled += len(rows)
+    return filled
+
+
+def backfill_event_cells(session):
+    """ Fill the event_cell rows of events with more than one coordinate
+    stored before the table existed. """
+    ids = [i for (i,) in session.query(Event.id)
+            .filter(Event.geometry != None)
+            .filter(~Event.id.in_(session.query(EventCell.event_id)))]
+    filled = 0
+    for i in range(0, len(ids), _GEOMETRY_BATCH_SIZE):
+        rows = []
+        for event_id, geometry in session.query(Event.id, Event.geometry)\
+                .filter(Event.id.in_(ids[i:i + _GEOMETRY_BATCH_SIZE])):
+            coordinates = polyline.decode_polyline(geometry)
+            if len(coordinates) > 1:
+                rows.extend({'event_id': event_id, 'cell': cell}
+                        for cell in spatial.shape_cells(coordinates))
+                filled += 1
+        if rows:
+            session.execute(EventCell.__table__.insert(), rows)
+    session.commit()
+    return filled
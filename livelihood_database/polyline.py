@@ -0,0 +1,51 @@
+# coding=utf-8
+
+""" Encoded polyline format (as in the Google Maps APIs) of a list of
+(latitude, longitude) pairs. With the default precision of 6, vertices are
+stored as integer micro-degrees (about 0.1 m), each as the difference from
+the previous vertex, so a shape takes a few bytes per vertex. """
+
+PRECISION = 6
+
+
+def encode_polyline(coordinates, precision=PRECISION):
+    factor = 10 ** precision
+    chunks = []
+    last_latitude = last_longitude = 0
+    for latitude, longitude in coordinates:
+        latitude = int(round(float(latitude) * factor))
+        longitude = int(round(float(longitude) * factor))
+        _encode_value(latitude - last_latitude, chunks)
+        _encode_value(longitude - last_longitude, chunks)
+        last_latitude, last_longitude = latitude, longitude
+    return ''.join(chunks)
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def decode_polyline(text, precision=PRECISION):
+    """ The list of (latitude, longitude) pairs of an encoded polyline. """
+    factor = float(10 ** precision)
+    coordinates = []
+    values = [0, 0]
+    index = 0
+    length = len(text)
+    while index < length:
+        for i in (0, 1):
+            shift = result = 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            values[i] += ~(result >> 1) if result & 1 else result >> 1
+        coordinates.append((values[0] / factor, values[1] / factor))
+    return coordinates
@@ -1,66 +1,145 @@
 # coding=utf-8
 
-from bs4 import BeautifulSoup
+import functools
+import logging
+from lxml import html
 import requests
 import re
+from . import address_normalizer
 from . import datetime_parser
 from . import map_converter
+from . import metrics
+from .address_normalizer import substitute
+
+logger = logging.getLogger(__name__)
 
 _SN_DESC_INFO_REGEX = '([A-Z\da-z]*)(.+)'
-_ADDRESS_REGEX = '(?:\d*)?(?:台灣)?((?:.*?市)?)((?:.*?區)?)((?:.*?(?:路|街|大道|橋))?(?:[一二三四五六七八九十\d]*?段)?(?:\d*?巷)?(?:\d*?弄)?(?:[-\d]*?號)?)(?:.*)'
+_ADDRESS_REGEX = address_normalizer.ADDRESS_REGEX
 _MAP_LOCATION_REGEX = '(?:\d*)?(?:台灣)?(.*?市)?(.*?區)?(.*)?'
 
 info_pattern = re.compile(_SN_DESC_INFO_REGEX)
-address_pattern = re.compile(_ADDRESS_REGEX)
+address_pattern = address_normalizer.address_pattern
 location_pattern = re.compile(_MAP_LOCATION_REGEX)
 
+_date_noise_pattern = re.compile('\s|停電日期：')
+_date_split_pattern = re.compile('年|月|日')
+_start_time_noise_pattern = re.compile('\s|自')
+_end_time_noise_pattern = re.compile('\s|至')
+_space_pattern = re.compile('\s')
+_info_noise_pattern = re.compile(',因\)|\)')
+
+_POWER_TABLE_XPATH = "//table[contains(concat(' ', normalize-space(@class), ' '), ' PowerCutTable ')]"
+
 def get_html_info(results):
-    html_soup = BeautifulSoup(results.text, 'lxml')
+    return geocode_html_records(get_html_records(results))
 
-    table = html_soup.find_all(class_='PowerCutTable')
+def get_html_records(results):
+    """ Parse the bulletin page into power event records without geocoding them:
+    (date, start time, end time, serial number, description, address text). """
+    return parse_html_records(results.text)
 
-    events = []
-    for rows in table:
-        table_date = rows.caption
-        table_content = rows.find_all('td')
+def parse_html_records(text):
+    """ get_html_records for the text of a page, e.g. in a worker process. """
+    return list(iter_html_records(text))
 
-        i = 0
-        while( i != len(table_content)):
+def iter_html_records(text):
+    """ Yield the records of get_html_records one by one. Only the PowerCutTable
+    elements are visited and each table's caption date is parsed once. """
+    try:
+        document = html.fromstring(text)
+    except ValueError:
+        # lxml rejects str input carrying an XML encoding declaration.
+        document = html.fromstring(text.encode('utf-8'), parser=html.HTMLParser(encoding='utf-8'))
 
-            # start date (end date)
-            date_info = get_html_date(table_date.contents[0])
+    for table in document.xpath(_POWER_TABLE_XPATH):
+
+        # start date (end date)
+        date_info = get_html_date(_get_html_content(table.find('caption'), 0))
+
+        table_content = table.xpath('.//td')
+
+        i = 0
+        while( i + 1 < len(table_content)):
 
             # start time
-            start_time_info = get_html_start_time(table_content[i].contents[0])
+            start_time_info = get_html_start_time(_get_html_content(table_content[i], 0))
 
             # end time
-            end_time_info = get_html_end_time(table_content[i].contents[2])
+            end_time_info = get_html_end_time(_get_html_content(table_content[i], 2))
 
             # serial number and description
-            sn_info, description_info = get_html_serial_number_description(table_content[i+1].contents[0])
+            sn_info, description_info = get_html_serial_number_description(_get_html_content(table_content[i+1], 0))
 
-            # address and coordinate
-            location_info, (latitude, longitude) = get_html_address_coordinate(table_content[i+1].contents[2])
+            # address
+            address_info = _get_html_content(table_content[i+1], 2)
 
-            events.append((
+            yield (
                 date_info,
                 start_time_info,
                 end_time_info,
                 sn_info,
                 description_info,
-                location_info,
-                latitude,
-                longitude))
+                address_info)
             i += 2
 
+def _get_html_content(element, index):
+    """ The index-th text node of element counting child elements as nodes,
+    like BeautifulSoup's Tag.contents[index]. Return None if there is none. """
+    if element is None:
+        return None
+    contents = []
+    if element.text:
+        contents.append(element.text)
+    for child in element:
+        contents.append(None)
+        if child.tail:
+            contents.append(child.tail)
+    if index < len(contents):
+        return contents[index]
+    return None
+
+def geocode_html_records(records):
+    """ Resolve the address text of records from get_html_records, returning
+    (date, start time, end time, serial number, description, location,
+    latitude, longitude) tuples. """
+
+    # Geocode the preferred address of every record concurrently; the
+    # per-record conversion below is then answered from map_converter's cache.
+    first_addresses = []
+    for record in records:
+        candidates = get_html_address_candidates(record[5])
+        if candidates:
+            first_addresses.append(candidates[0][0])
+    map_converter.convert_addresses_to_coordinates(first_addresses)
+
+    events = []
+    for (date_info, start_time_info, end_time_info, sn_info, description_info, address_info) in records:
+
+        # address and coordinate
+        location_info, (latitude, longitude) = get_html_address_coordinate(address_info)
+
+        events.append((
+            date_info,
+            start_time_info,
+            end_time_info,
+            sn_info,
+            description_info,
+            location_info,
+            latitude,
+            longitude))
+
     return events
 
+def _parse_failure(message, *args):
+    metrics.increment('power_parse_failures')
+    logger.debug(message, *args)
+
 def get_html_date(raw_str_0):
     if raw_str_0:
 
         # start date (end date)
-        date_token = re.sub('\s|停電日期：', '', raw_str_0)
-        date_group = re.split('年|月|日', date_token)
+        date_token = _date_noise_pattern.sub('', raw_str_0)
+        date_group = _date_split_pattern.split(date_token)
 
         if len(date_group)>=3:
             date_group[1] = date_group[1].zfill(2)
@@ -69,57 +148,57 @@ def get_html_date(raw_str_0):
 
             return event_date
         else:
-            print('Unrecognized date: ' + raw_str_0)
+            _parse_failure('Unrecognized date: %s', raw_str_0)
             return None
 
     else:
-        print('The date of power event is None')
+        _parse_failure('The date of power event is None')
         return None
 
 def get_html_start_time(raw_str_1):
     if raw_str_1:
 
         # start time
-        start_time_token = re.sub('\s|自', '', raw_str_1)
-        start_time_group = re.split('時', start_time_token)
+        start_time_token = _start_time_noise_pattern.sub('', raw_str_1)
+        start_time_group = start_time_token.split('時')
 
         if len(start_time_group)>=2:
             event_start_time = datetime_parser._process_time(None, start_time_group[0], start_time_group[1])
 
             return event_start_time
         else:
-            print('Unrecognized time format: ' + raw_str_1)
+            _parse_failure('Unrecognized time format: %s', raw_str_1)
             return None
 
     else:
-        print('The start time of power event is None')
+        _parse_failure('The start time of power event is None')
         return None
 
 def get_html_end_time(raw_str_2):
     if raw_str_2:
 
         # end time
-        end_time_token = re.sub('\s|至', '', raw_str_2)
-        end_time_group = re.split('時', end_time_token)
+        end_time_token = _end_time_noise_pattern.sub('', raw_str_2)
+        end_time_group = end_time_token.split('時')
 
         if len(end_time_group)>=2:
             event_end_time = datetime_parser._process_time(None, end_time_group[0], end_time_group[1])
 
             return event_end_time
         else:
-            print('Unrecognized time format: ' + raw_str_2)
+            _parse_failure('Unrecognized time format: %s', raw_str_2)
             return None
 
     else:
-        print('The end time of power event is None')
+        _parse_failure('The end time of power event is None')
         return None
 
 def get_html_serial_number_description(raw_str_3):
     if raw_str_3:
-        info_token = re.sub('\s', '', raw_str_3)
-        info_token = re.sub('短暫停電', '-短暫停電', info_token)
-        info_token = re.sub('\(', '', info_token)
-        info_token = re.sub(',因\)|\)', '', info_token)
+        info_token = _space_pattern.sub('', raw_str_3)
+        info_token = info_token.replace('短暫停電', '-短暫停電')
+        info_token = info_token.replace('(', '')
+        info_token = _info_noise_pattern.sub('', info_token)
 
         info_result = info_pattern.search(info_token)
 
@@ -129,89 +208,74 @@ def get_html_serial_number_description(raw_str_3):
 
             return (event_serial_number, event_description)
         else:
-            print('Unable to parse description: ' + raw_str_3)
+            _parse_failure('Unable to parse description: %s', raw_str_3)
             return (None, None)
 
     else:
-        print('The serial number and description of power event are None')
+        _parse_failure('The serial number and description of power event are None')
         return (None, None)
 
-def substitute(sub_before, sub_after, address_str, delete_flag):
-    str = list(address_str)    
-    i = 0
-    while(i != len(str)):
-        if str[i] == sub_before:
-            if not delete_flag:
-                if not i == 0:
-                    if str[i-1].isnumeric():
-                        str[i] = sub_after
-                    else:
-                        str[i] = ''
-            else:
-                if not i == 0 and not str[i-1].isnumeric():
-                    str[i] = sub_after
-        i += 1    
-    return ''.join(str)
-
 def substitute_address_conjunction(str):
-    str = substitute('－', '-', str, False)
-    str = substitute('之', '-', str, False)
-    str = substitute('至', '號', str, False)
-    str = substitute('及', '號', str, False)
-    str = re.sub('．|‧|、|／|/|～|~', '號', str)
-    str = substitute('號', '', str, True)
-    return str
+    return address_normalizer.substitute_conjunctions(str)
+
+def get_html_address_candidates(raw_str_4):
+    """ Addresses to geocode for a power event, in order of preference, as (address, district) pairs. """
+    if raw_str_4:
+        return list(_get_address_candidates(address_normalizer.clean_address_text(raw_str_4)))
+    return []
+
+@functools.lru_cache(maxsize=address_normalizer.CACHE_SIZE)
+def _get_address_candidates(address_token):
+    candidates = []
+    for str in address_token.split('，'):
+        str = address_normalizer.substitute_conjunctions(str)
+        address_groups = address_normalizer.parse_address(str)
+
+        if address_groups:
+            address_groups = list(address_groups)
+            if not address_groups[0]:
+                address_groups[0] = '台北市'
+            candidates.append((''.join(address_groups), address_groups[1]))
+    return tuple(candidates)
 
 def get_html_address_coordinate(raw_str_4):
     if raw_str_4:
-        address_token = re.sub('\s|（|）', '', raw_str_4)
-        address_list = re.split('，', address_token)
-
-        for str in address_list:
-            str = substitute_address_conjunction(str)
-            address = address_pattern.search(str)
-
-            """ Grep automatically the next address of the address list if it is unable to parse the address. """
-            if address:
-                address_groups = list(address.groups())
-                if not address_groups[0]:
-                    address_groups[0] = '台北市'
-                district = address_groups[1]
-                final_address = ''.join(address_groups)
-
-                coordinate, raw_location = map_converter.convert_address_to_coordinate(final_address)
-
-                location = substitute('號', '', raw_location, True)
-                index_num = location.rfind('號')
-                if index_num != -1:
-                    location = location[:(index_num+1)]
-
-                """ Grep automatically the next address of the address list if it is unable to convert the location. """
-                if location:
-                    final_location = location_pattern.search(location)
-
-                    if final_location:
-                        final_location_groups = list(final_location.groups())
-                        if not final_location_groups[0]:
-                            final_location_groups[0] = '台北市'
-                        if not final_location_groups[1] and district:
-                            final_location_groups[1] = district
-                        final_location_groups = tuple(final_location_groups)
-
-                        return (final_location_groups, coordinate)
-                    else:
-                        print('Unable to parse location: ' + raw_location)
-                        return ((None, None, None), coordinate)
+        candidates = get_html_address_candidates(raw_str_4)
+
+        """ Grep automatically the next address of the address list if it is unable to parse the address. """
+        for final_address, district in candidates:
+            coordinate, raw_location = map_converter.convert_address_to_coordinate(final_address)
+
+            location = substitute('號', '', raw_location, True)
+            index_num = location.rfind('號')
+            if index_num != -1:
+                location = location[:(index_num+1)]
+
+            """ Grep automatically the next address of the address list if it is unable to convert the location. """
+            if location:
+                final_location = location_pattern.search(location)
+
+                if final_location:
+                    final_location_groups = list(final_location.groups())
+                    if not final_location_groups[0]:
+                        final_location_groups[0] = '台北市'
+                    if not final_location_groups[1] and district:
+                        final_location_groups[1] = district
+                    final_location_groups = tuple(final_location_groups)
+
+                    return (final_location_groups, coordinate)
+                else:
+                    _parse_failure('Unable to parse location: %s', raw_location)
+                    return ((None, None, None), coordinate)
         
-        if not address:
-            print('Unable to parse address: ' + raw_str_4)
+        if not candidates:
+            _parse_failure('Unable to parse address: %s', raw_str_4)
             return ((None, None, None), (None, None))
         
-        print('It is failed to convert address to coordinate: ' + final_address)
+        # Counted by map_converter as geocode_failures.
+        logger.debug('It is failed to convert address to coordinate: %s', final_address)
         return ((None, None, None), coordinate)
         
     else:
-        print('The address of power event is None')
+        _parse_failure('The address of power event is None')
         return ((None, None, None), (None, None))
-
-
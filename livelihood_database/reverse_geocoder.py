@@ -0,0 +1,182 @@
+# coding=utf-8
+
+""" Offline reverse geocoding of points in Taiwan from local files:
+
+- district boundaries, a GeoJSON FeatureCollection of Polygon or
+  MultiPolygon features whose properties name the city and district (by
+  default COUNTYNAME and TOWNNAME, as in the NLSC township boundaries);
+- address points, a CSV file with a latitude, longitude and address column
+  per house number.
+
+A point is answered with the address of the nearest address point, in the
+district containing the point, as city + district + street and number, the
+form location_parser expects from Google. The answer is None, and the
+caller should ask Google, when the point is in no district or several, or
+when the nearest address point is too far or lies in another district. """
+
+import csv
+import json
+import logging
+import math
+import os
+import threading
+
+from . import address_normalizer
+from . import spatial
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_MAX_DISTANCE = 30
+# Grid cell sizes, in degrees, of the district and address point indexes.
+_DISTRICT_CELL_SIZE = 0.01
+_POINT_CELL_SIZE = 0.0005
+
+
+class ReverseGeocoder(object):
+
+    def __init__(self, boundaries_path, addresses_path, max_distance=_DEFAULT_MAX_DISTANCE,
+            city_property='COUNTYNAME', district_property='TOWNNAME',
+            latitude_column='latitude', longitude_column='longitude', address_column='address'):
+        """ max_distance is the distance in metres beyond which the nearest
+        address point is not trusted. The files are loaded on first use. """
+        self.boundaries_path = boundaries_path
+        self.addresses_path = addresses_path
+        self.max_distance = max_distance
+        self.city_property = city_property
+        self.district_property = district_property
+        self.latitude_column = latitude_column
+        self.longitude_column = longitude_column
+        self.address_column = address_column
+
+        # (city, district, polygons) per district, a polygon being a list of
+        # rings of (longitude, latitude), and district indexes per grid cell.
+        self._districts = None
+        self._district_cells = None
+        # (latitude, longitude, city, district, detail address) per address
+        # point, grouped by grid cell.
+        self._point_cells = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls):
+        """ A ReverseGeocoder of the files named by
+        LDB_REVERSE_GEOCODE_BOUNDARIES and LDB_REVERSE_GEOCODE_ADDRESSES, or
+        None unless both are set. """
+        boundaries_path = os.environ.get('LDB_REVERSE_GEOCODE_BOUNDARIES')
+        addresses_path = os.environ.get('LDB_REVERSE_GEOCODE_ADDRESSES')
+        if not boundaries_path or not addresses_path:
+            return None
+        return cls(boundaries_path, addresses_path, float(os.environ.get(
+                'LDB_REVERSE_GEOCODE_DISTANCE', _DEFAULT_MAX_DISTANCE)))
+
+    def load(self):
+        """ Load the files now instead of on the first lookup. """
+        with self._lock:
+            if self._point_cells is None:
+                self._load_boundaries()
+                self._load_addresses()
+
+    def _load_boundaries(self):
+        with open(self.boundaries_path, encoding='utf-8-sig') as f:
+            collection = json.load(f)
+        districts = []
+        cells = {}
+        for feature in collection['features']:
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            polygons = [[[(float(c[0]), float(c[1])) for c in ring] for ring in polygon]
+                    for polygon in polygons]
+            properties = feature['properties']
+            index = len(districts)
+            districts.append((_normalize_city(properties[self.city_property]),
+                    properties[self.district_property], polygons))
+
+            longitudes = [c[0] for polygon in polygons for c in polygon[0]]
+            latitudes = [c[1] for polygon in polygons for c in polygon[0]]
+            first_row, first_column = _cell(min(latitudes), min(longitudes), _DISTRICT_CELL_SIZE)
+            last_row, last_column = _cell(max(latitudes), max(longitudes), _DISTRICT_CELL_SIZE)
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    cells.setdefault((row, column), []).append(index)
+        self._districts = districts
+        self._district_cells = cells
+        logger.info('Loaded %d district boundaries', len(districts))
+
+    def _load_addresses(self):
+        cells = {}
+        loaded = 0
+        with open(self.addresses_path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                address = address_normalizer.clean_address_text(row[self.address_column])
+                # Not parse_address: its memo would only hold the last addresses.
+                match = address_normalizer.address_pattern.search(address)
+                if not match or not match.group(3):
+                    continue
+                parsed = match.groups()
+                try:
+                    latitude = float(row[self.latitude_column])
+                    longitude = float(row[self.longitude_column])
+                except ValueError:
+                    continue
+                point = (latitude, longitude, _normalize_city(parsed[0]), parsed[1], parsed[2])
+                cells.setdefault(_cell(latitude, longitude, _POINT_CELL_SIZE), []).append(point)
+                loaded += 1
+        self._point_cells = cells
+        logger.info('Loaded %d address points', loaded)
+
+    def district(self, latitude, longitude):
+        """ (city, district) of the district containing a point, or None if
+        the point is in no district or in several. """
+        if self._point_cells is None:
+            self.load()
+        found = None
+        for index in self._district_cells.get(_cell(latitude, longitude, _DISTRICT_CELL_SIZE), ()):
+            city, district, polygons = self._districts[index]
+            if any(spatial.polygon_contains(polygon, longitude, latitude) for polygon in polygons):
+                if found is not None and found != (city, district):
+                    return None
+                found = (city, district)
+        return found
+
+    def reverse(self, latitude, longitude):
+        """ The address of a point, or None if the local answer is ambiguous. """
+        latitude, longitude = float(latitude), float(longitude)
+        district = self.district(latitude, longitude)
+        if district is None:
+            return None
+
+        nearest, nearest_distance = None, self.max_distance
+        delta_latitude = math.degrees(self.max_distance / spatial.EARTH_RADIUS)
+        delta_longitude = delta_latitude / math.cos(math.radians(latitude))
+        first_row, first_column = _cell(latitude - delta_latitude, longitude - delta_longitude,
+                _POINT_CELL_SIZE)
+        last_row, last_column = _cell(latitude + delta_latitude, longitude + delta_longitude,
+                _POINT_CELL_SIZE)
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                for point in self._point_cells.get((row, column), ()):
+                    distance = spatial.haversine(latitude, longitude, point[0], point[1])
+                    if distance <= nearest_distance:
+                        nearest, nearest_distance = point, distance
+        if nearest is None:
+            return None
+
+        city, district_name = district
+        # An address point in another district: the point is near a border.
+        if (nearest[3] and nearest[3] != district_name) or (nearest[2] and nearest[2] != city):
+            return None
+        return city + district_name + nearest[4]
+
+
+def _cell(latitude, longitude, size):
+    return (int(math.floor(latitude / size)), int(math.floor(longitude / size)))
+
+
+def _normalize_city(city):
+    """ Google spells 臺 (as in 臺北市) 台; keep the spelling of stored events. """
+    return city.replace('臺', '台') if city else city
@@ -0,0 +1,256 @@
+# coding=utf-8
+
+""" Read-side queries of the events affecting a location.
+
+Every coordinate row carries the grid cell of its vertex (see grid_cell),
+stored in an index together with the vertex and its event id. A query reads
+the cells covering its bounding box from that index, keeps the vertices
+inside the box and joins their events; events_near then measures the exact
+haversine distance in Python. Events with more than one coordinate also
+have an event_cell row per grid cell their shape (the polygon of a closed
+ring, the line of an open one) crosses or covers, so a point inside a
+polygon or beside an edge, away from the vertices, matches too. Events with
+a single coordinate are only found by their coordinate row, so they have to
+be imported with DataImporter.write_coordinates on.
+
+This module only depends on dbschema, so consumers can use it without the
+importers' environment (LDB_URL, GOOGLE_GEO_KEY). """
+
+import math
+
+from sqlalchemy import or_
+
+from . import polyline
+from .dbschema import Coordinate, Event, EventCell
+
+# Size of a grid cell in degrees, about 1.1 km by 1 km in Taiwan.
+CELL_SIZE = 0.01
+
+_LONGITUDE_CELLS = int(round(360 / CELL_SIZE))
+# Above this many rows of cells, vertices are filtered on their ranges only and
+# shapes on the range of cells from the first to the last.
+_MAX_CELL_ROWS = 64
+# Upper bound of ids in a single IN clause, below SQLite's variable limit.
+_BULK_CHUNK_SIZE = 500
+# Mean radius of the Earth in metres.
+EARTH_RADIUS = 6371008.8
+_METRES_PER_DEGREE = math.radians(EARTH_RADIUS)
+
+
+def grid_cell(latitude, longitude):
+    """ The number of the CELL_SIZE grid cell containing a vertex. Cells are
+    numbered row by row from (-90, -180), so the cells of a row of a
+    bounding box are a range of numbers. """
+    row, column = _cell_index(float(latitude), float(longitude))
+    return row * _LONGITUDE_CELLS + column
+
+
+def _cell_index(latitude, longitude):
+    return (int(math.floor((latitude + 90) / CELL_SIZE)),
+            int(math.floor((longitude + 180) / CELL_SIZE)))
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """ Great-circle distance in metres between two WGS84 points. """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+            math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def shape_cells(coordinates):
+    """ The grid cells crossed or covered by the shape of (latitude,
+    longitude) pairs: the polygon of a closed ring, the line of an open
+    one. """
+    coordinates = [(float(latitude), float(longitude)) for latitude, longitude in coordinates]
+    first_row, first_column = _cell_index(min(c[0] for c in coordinates), min(c[1] for c in coordinates))
+    last_row, last_column = _cell_index(max(c[0] for c in coordinates), max(c[1] for c in coordinates))
+    cells = []
+    for row in range(first_row, last_row + 1):
+        south = row * CELL_SIZE - 90
+        for column in range(first_column, last_column + 1):
+            west = column * CELL_SIZE - 180
+            if _shape_in_bbox(coordinates, south, west, south + CELL_SIZE, west + CELL_SIZE):
+                cells.append(row * _LONGITUDE_CELLS + column)
+    return cells
+
+
+def polygon_contains(polygon, x, y):
+    """ Whether the point (x, y) is inside a polygon given as its outer ring
+    and holes, by the even-odd rule. """
+    inside = False
+    for ring in polygon:
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            xi, yi = ring[i]
+            xj, yj = ring[j]
+            if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+                inside = not inside
+            j = i
+    return inside
+
+
+def distance(latitude, longitude, coordinates):
+    """ Distance in metres from a point to the shape of (latitude,
+    longitude) pairs: 0 inside the polygon of a closed ring, otherwise to
+    the nearest edge. Edges are measured on a plane tangent at the point,
+    which is exact enough at the scale of a query radius. """
+    latitude, longitude = float(latitude), float(longitude)
+    coordinates = [(float(c[0]), float(c[1])) for c in coordinates]
+    if len(coordinates) == 1:
+        return haversine(latitude, longitude, coordinates[0][0], coordinates[0][1])
+    if _is_ring(coordinates) and polygon_contains([coordinates], latitude, longitude):
+        return 0.0
+    scale = math.cos(math.radians(latitude))
+    points = [((c[1] - longitude) * scale * _METRES_PER_DEGREE, (c[0] - latitude) * _METRES_PER_DEGREE)
+            for c in coordinates]
+    return min(_segment_distance(points[i], points[i + 1]) for i in range(len(points) - 1))
+
+
+def events_near(session, latitude, longitude, radius_m, date_range=None, event_type=None,
+        active=True):
+    """ The events within radius_m metres of a point, by a coordinate or,
+    for events with more than one coordinate, by their shape (see
+    distance), as a list of (Event, distance in metres) sorted by distance.
+
+    date_range is a (start, end) pair of dates, either of them None for an
+    open end, and keeps the events whose dates overlap it. event_type is an
+    EventType to keep only events of that type; active is True (the
+    default) or False to keep only active or inactive events, None for
+    both. """
+    latitude, longitude = float(latitude), float(longitude)
+    delta_latitude = math.degrees(radius_m / EARTH_RADIUS)
+    delta_longitude = delta_latitude / max(math.cos(math.radians(latitude)), 1e-6)
+    bbox = (latitude - delta_latitude, longitude - delta_longitude,
+            latitude + delta_latitude, longitude + delta_longitude)
+
+    distances = {}
+    for event_id, vertex_latitude, vertex_longitude in _vertices_in_bbox(
+            session, *bbox, date_range, event_type, active):
+        d = haversine(latitude, longitude, float(vertex_latitude), float(vertex_longitude))
+        if d <= radius_m and d < distances.get(event_id, radius_m + 1):
+            distances[event_id] = d
+    for event_id, coordinates in _shapes_in_bbox(session, *bbox, date_range, event_type, active):
+        d = distance(latitude, longitude, coordinates)
+        if d <= radius_m and d < distances.get(event_id, radius_m + 1):
+            distances[event_id] = d
+    return sorted(((e, distances[e.id]) for e in _load_events(session, distances)),
+            key=lambda pair: pair[1])
+
+
+def events_in_bbox(session, south, west, north, east, date_range=None, event_type=None,
+        active=True):
+    """ The events with a coordinate inside a bounding box given by its
+    latitude and longitude bounds, or whose shape crosses or covers it. The
+    filters are those of events_near. """
+    south, west, north, east = float(south), float(west), float(north), float(east)
+    ids = set(event_id for event_id, _, _ in
+            _vertices_in_bbox(session, south, west, north, east, date_range, event_type, active))
+    ids.update(event_id for event_id, coordinates in
+            _shapes_in_bbox(session, south, west, north, east, date_range, event_type, active)
+            if _shape_in_bbox(coordinates, south, west, north, east))
+    return _load_events(session, ids)
+
+
+def _vertices_in_bbox(session, south, west, north, east, date_range, event_type, active):
+    """ The (event id, latitude, longitude) rows of the matching events'
+    coordinates inside the bounding box. """
+    south, west, north, east = float(south), float(west), float(north), float(east)
+    query = session.query(Coordinate.event_id, Coordinate.wgs84_latitude, Coordinate.wgs84_longitude)\
+            .join(Event, Coordinate.event_id == Event.id)\
+            .filter(Coordinate.wgs84_latitude.between(south, north))\
+            .filter(Coordinate.wgs84_longitude.between(west, east))
+
+    first_row, first_column = _cell_index(south, west)
+    last_row, last_column = _cell_index(north, east)
+    if last_row - first_row < _MAX_CELL_ROWS:
+        query = query.filter(_in_cells(Coordinate.cell, south, west, north, east))
+    return _filter_events(query, date_range, event_type, active).all()
+
+
+def _shapes_in_bbox(session, south, west, north, east, date_range, event_type, active):
+    """ The (event id, coordinates) of the matching events with a shape in
+    a grid cell of the bounding box. """
+    south, west, north, east = float(south), float(west), float(north), float(east)
+    query = session.query(Event.id, Event.geometry)\
+            .join(EventCell, EventCell.event_id == Event.id)\
+            .filter(_in_cells(EventCell.cell, south, west, north, east))\
+            .distinct()
+    return [(event_id, polyline.decode_polyline(geometry))
+            for event_id, geometry in _filter_events(query, date_range, event_type, active)]
+
+
+def _in_cells(cell, south, west, north, east):
+    """ The condition on a cell column to be in a cell of the bounding box,
+    as a range of cells per row. """
+    first_row, first_column = _cell_index(south, west)
+    last_row, last_column = _cell_index(north, east)
+    if last_row - first_row >= _MAX_CELL_ROWS:
+        return cell.between(first_row * _LONGITUDE_CELLS + first_column,
+                last_row * _LONGITUDE_CELLS + last_column)
+    return or_(*[cell.between(row * _LONGITUDE_CELLS + first_column, row * _LONGITUDE_CELLS + last_column)
+            for row in range(first_row, last_row + 1)])
+
+
+def _filter_events(query, date_range, event_type, active):
+    if event_type is not None:
+        query = query.filter(Event.type == event_type)
+    if active is not None:
+        query = query.filter(Event.is_active == active)
+    if date_range is not None:
+        start, end = date_range
+        if end is not None:
+            query = query.filter(Event.start_date <= end)
+        if start is not None:
+            query = query.filter(Event.end_date >= start)
+    return query
+
+
+def _is_ring(coordinates):
+    return len(coordinates) > 3 and coordinates[0] == coordinates[-1]
+
+
+def _shape_in_bbox(coordinates, south, west, north, east):
+    """ Whether an edge of the shape crosses the bounding box, or the box is
+    inside the polygon of a closed ring. """
+    for i in range(len(coordinates) - 1):
+        if _segment_in_bbox(coordinates[i], coordinates[i + 1], south, west, north, east):
+            return True
+    return _is_ring(coordinates) and \
+            polygon_contains([coordinates], (south + north) / 2, (west + east) / 2)
+
+
+def _segment_in_bbox(a, b, south, west, north, east):
+    """ Whether the segment from a to b, (latitude, longitude) pairs, has a
+    point in the bounding box, by Liang-Barsky clipping. """
+    first, last = 0.0, 1.0
+    delta_latitude, delta_longitude = b[0] - a[0], b[1] - a[1]
+    for p, q in ((-delta_latitude, a[0] - south), (delta_latitude, north - a[0]),
+            (-delta_longitude, a[1] - west), (delta_longitude, east - a[1])):
+        if p == 0:
+            if q < 0:
+                return False
+        elif p < 0:
+            first = max(first, q / p)
+        else:
+            last = min(last, q / p)
+        if first > last:
+            return False
+    return True
+
+
+def _segment_distance(a, b):
+    """ Distance from the origin to the segment from a to b. """
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, -(a[0] * dx + a[1] * dy) / length))
+    return math.hypot(a[0] + t * dx, a[1] + t * dy)
+
+
+def _load_events(session, ids):
+    ids = list(ids)
+    events = []
+    for i in range(0, len(ids), _BULK_CHUNK_SIZE):
+        events.extend(session.query(Event).filter(Event.id.in_(ids[i:i + _BULK_CHUNK_SIZE])))
+    return events
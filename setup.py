@@ -11,7 +11,11 @@ setup(name='livelihood_database',
       license='MIT',
       packages=['livelihood_database'],
       install_requires=[
+          'lxml',
           'requests>=2.17.3',
           'sqlalchemy>=1.1.10',
       ],
+      extras_require={
+          'numpy': ['numpy'],
+      },
       zip_safe=False)